@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+"""reusable buffers for Phenox API calls.
+
+'get_image', 'get_imgfeature', 'get_sound', 'get_selfstate' and
+'get_pconfig' allocate new objects on every call unless a buffer is given.
+during a long flight those allocations cause GC pauses in the control tick.
+this module hands out reusable buffers for them.
+
+usage:
+
+pools = PhenoxBufferPools()
+
+with pools.frames.buffer() as img:
+    if px.get_image(px.PX_BOTTOM_CAM, 'ndarray', img):
+        #process img in this block only
+        pass
+
+st = pools.selfstate.acquire()
+px.get_selfstate(st)
+...
+pools.selfstate.release(st)
+
+feature = pools.features(200).acquire()
+n = px.get_imgfeature(200, feature)
+
+allocation statistics are reported by 'get_stats' of each pool,
+and AllocationMonitor reports memory blocks allocated and GC activity
+per second to compare the code before and after using pools.
+"""
+
+import ctypes
+import contextlib
+import gc
+import sys
+import threading
+
+import numpy
+
+from phenox_client import (
+    PX_CAM_DATA_SHAPE, ImageFeature, SelfState, PhenoxConfig,
+    monotonic_clock
+    )
+
+
+class BufferPool(object):
+    """pool of reusable buffers created by factory
+
+    factory: function with no argument which returns a new buffer
+    size: number of buffers allocated in advance
+    max_free: maximum number of released buffers kept in the pool
+        (None means unlimited)
+    """
+
+    def __init__(self, factory, size=0, max_free=None):
+        self.factory = factory
+        self.max_free = max_free
+        self._lock = threading.Lock()
+        self._free = []
+        #ids of the acquired buffers to detect double release
+        self._acquired = set()
+        self.in_use = 0
+        self.reset_stats()
+        for _ in range(size):
+            buf = self._allocate()
+            self._free.append(buf)
+
+    def _allocate(self):
+        self.allocations += 1
+        return self.factory()
+
+    def acquire(self):
+        """return a free buffer (allocate new one if pool is empty)
+
+        the content of the buffer is undefined.
+        """
+        with self._lock:
+            self.acquires += 1
+            if self._free:
+                buf = self._free.pop()
+            else:
+                buf = self._allocate()
+            self._acquired.add(id(buf))
+            self.in_use = len(self._acquired)
+            return buf
+
+    def release(self, buf):
+        """return buffer to the pool; do not use buf after this call
+
+        ValueError is raised if buf is not acquired from this pool
+        (e.g. already released).
+        """
+        with self._lock:
+            if id(buf) not in self._acquired:
+                raise ValueError("buffer is already released")
+            self._acquired.discard(id(buf))
+            self.in_use = len(self._acquired)
+            if self.max_free is None or len(self._free) < self.max_free:
+                self._free.append(buf)
+
+    @contextlib.contextmanager
+    def buffer(self):
+        """context manager which acquires and releases a buffer"""
+        buf = self.acquire()
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    def reset_stats(self):
+        """reset allocation statistics"""
+        self.allocations = 0
+        self.acquires = 0
+        self._stats_started = monotonic_clock()
+
+    def get_stats(self):
+        """return dict of allocation statistics"""
+        elapsed = monotonic_clock() - self._stats_started
+        return {
+            "allocations": self.allocations,
+            "acquires": self.acquires,
+            "in_use": self.in_use,
+            "free": len(self._free),
+            "allocations_per_sec":
+                self.allocations / elapsed if elapsed > 0 else 0.0
+        }
+
+
+class PhenoxBufferPools(object):
+    """set of buffer pools for Phenox API
+
+    frames: numpy.ndarray of PX_CAM_DATA_SHAPE for 'get_image'
+    selfstate: SelfState for 'get_selfstate'
+    pconfig: PhenoxConfig for 'get_pconfig'
+    features(maxnum): (ImageFeature * maxnum) for 'get_imgfeature'
+    sound(recordtime): (c_short * n) for 'get_sound'
+    """
+
+    def __init__(self, frames=2, selfstate=1, pconfig=1):
+        self.frames = BufferPool(
+            lambda: numpy.empty(PX_CAM_DATA_SHAPE, numpy.uint8), frames)
+        self.selfstate = BufferPool(SelfState, selfstate)
+        self.pconfig = BufferPool(PhenoxConfig, pconfig)
+        self._features = {}
+        self._sound = {}
+        self._lock = threading.Lock()
+
+    def features(self, maxnum):
+        """return pool of (ImageFeature * maxnum) arrays"""
+        with self._lock:
+            if maxnum not in self._features:
+                self._features[maxnum] = BufferPool(ImageFeature * maxnum)
+            return self._features[maxnum]
+
+    def sound(self, recordtime):
+        """return pool of sound buffers for recordtime second"""
+        size = int(recordtime * 10000)
+        with self._lock:
+            if size not in self._sound:
+                self._sound[size] = BufferPool(ctypes.c_short * size)
+            return self._sound[size]
+
+    def pools(self):
+        """return dict of all pools with their names"""
+        result = {
+            "frames": self.frames,
+            "selfstate": self.selfstate,
+            "pconfig": self.pconfig
+        }
+        with self._lock:
+            for maxnum, pool in self._features.items():
+                result["features({0})".format(maxnum)] = pool
+            for size, pool in self._sound.items():
+                result["sound({0})".format(size)] = pool
+        return result
+
+    def get_stats(self):
+        """return dict of pool name -> statistics"""
+        return dict(
+            (name, pool.get_stats()) for name, pool in self.pools().items()
+        )
+
+
+class AllocationMonitor(object):
+    """measure memory allocations and GC activity per second
+
+    usage:
+
+    monitor = AllocationMonitor(pools)
+    monitor.start()
+    #run the control loop for a while
+    print(monitor.get_stats())
+    monitor.stop()
+
+    reported values:
+        allocated_blocks: change of 'sys.getallocatedblocks()'; objects
+            which are still alive (e.g. buffers kept by the caller) are
+            counted, temporary objects freed before 'get_stats' are not
+            (None before Python 3.4)
+        pool_allocations: buffers allocated by the given pools
+        collections: GC collections per generation
+        pause_total, pause_max: GC pause time [s]
+            (needs 'gc.callbacks', Python 3.3+)
+
+    pools: PhenoxBufferPools or list of BufferPool (optional)
+    """
+
+    def __init__(self, pools=None):
+        self._callbacks = getattr(gc, "callbacks", None)
+        if isinstance(pools, PhenoxBufferPools):
+            self._pools = lambda: pools.pools().values()
+        else:
+            self._pools = lambda: list(pools or [])
+        self._started = None
+        self._pause_started = None
+        self.collections = [0, 0, 0]
+        self.pause_total = 0.0
+        self.pause_max = 0.0
+
+    def start(self):
+        """start measurement"""
+        self.collections = [0, 0, 0]
+        self.pause_total = 0.0
+        self.pause_max = 0.0
+        self._base_counts = self._collection_counts()
+        self._base_pool_allocations = self._pool_allocations()
+        if self._callbacks is not None and \
+           self._on_gc not in self._callbacks:
+            self._callbacks.append(self._on_gc)
+        self._started = monotonic_clock()
+        self._base_blocks = self._allocated_blocks()
+
+    def stop(self):
+        """stop measurement"""
+        if self._callbacks is not None and self._on_gc in self._callbacks:
+            self._callbacks.remove(self._on_gc)
+
+    def _allocated_blocks(self):
+        get_blocks = getattr(sys, "getallocatedblocks", None)
+        if get_blocks is None:
+            return None
+        return get_blocks()
+
+    def _pool_allocations(self):
+        return sum(pool.allocations for pool in self._pools())
+
+    def _collection_counts(self):
+        get_stats = getattr(gc, "get_stats", None)
+        if get_stats is None:
+            return None
+        return [s["collections"] for s in get_stats()]
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self._pause_started = monotonic_clock()
+        elif self._pause_started is not None:
+            pause = monotonic_clock() - self._pause_started
+            self._pause_started = None
+            self.pause_total += pause
+            if pause > self.pause_max:
+                self.pause_max = pause
+            self.collections[info["generation"]] += 1
+
+    def get_stats(self):
+        """return dict of allocation and GC statistics since 'start'"""
+        blocks = self._allocated_blocks()
+        elapsed = monotonic_clock() - self._started
+        if blocks is not None:
+            blocks -= self._base_blocks
+        counts = self.collections
+        base = self._base_counts
+        if self._callbacks is None and base is not None:
+            counts = [c - b for c, b in zip(self._collection_counts(), base)]
+        pool_allocations = (self._pool_allocations() -
+                            self._base_pool_allocations)
+
+        def per_sec(value):
+            if value is None or elapsed <= 0:
+                return None
+            return value / elapsed
+
+        return {
+            "elapsed": elapsed,
+            "allocated_blocks": blocks,
+            "allocated_blocks_per_sec": per_sec(blocks),
+            "pool_allocations": pool_allocations,
+            "pool_allocations_per_sec": per_sec(pool_allocations),
+            "collections": list(counts),
+            "collections_per_sec": per_sec(sum(counts)),
+            "pause_total": self.pause_total,
+            "pause_max": self.pause_max
+        }
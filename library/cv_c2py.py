@@ -2,7 +2,7 @@
 
 from ctypes import *
 
-from numpy import asarray
+from numpy import asarray, uint8
 import cv2
 
 
@@ -90,3 +90,30 @@ def ipl2array(ipl_ptr, img_shape):
     # and build ndarray from CvMat
     return asarray(cv_img[:, :])
 
+
+def ipl2array_into(ipl_ptr, out):
+    """copy image data of IplImage* into preallocated numpy.ndarray
+
+    ipl_ptr: POINTER(IplImage) that points to valid image
+    out: C contiguous uint8 ndarray with shape (height, width, n_channels)
+    """
+    iplimage = ipl_ptr.contents
+    shape = (iplimage.height, iplimage.width, iplimage.nChannels)
+    if out.shape != shape or out.dtype != uint8:
+        raise ValueError(
+            "out must be uint8 ndarray with shape {0}".format(shape))
+    if iplimage.depth != IPL_DEPTH_8U:
+        raise ValueError("only IPL_DEPTH_8U image is supported")
+    if not out.flags['C_CONTIGUOUS']:
+        raise ValueError("out must be C contiguous")
+    height = out.shape[0]
+    row_size = out.strides[0]
+    if iplimage.widthStep == row_size:
+        memmove(out.ctypes.data, iplimage.imageData, out.nbytes)
+    else:
+        #rows are padded in IplImage
+        for y in range(height):
+            memmove(out.ctypes.data + y * row_size,
+                    iplimage.imageData + y * iplimage.widthStep,
+                    row_size)
+    return out
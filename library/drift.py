@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""frame-to-frame drift estimation by phase correlation.
+
+the on-board 'vision_tx/ty' estimate depends on feature contrast
+('featurecontrast_bottom') and degrades over low-texture floors.
+PhaseCorrelationDrift computes the translation between consecutive
+PX_BOTTOM_CAM frames from the whole image with FFT phase correlation,
+so it keeps working where few feature points are found.
+
+usage:
+
+estimator = PhaseCorrelationDrift()
+st = px.SelfState()
+while True:
+    img = px.get_image(px.PX_BOTTOM_CAM, 'ndarray')
+    if img is None:
+        continue
+    px.get_selfstate(st)
+    result = estimator.update(img, st.height)
+    if result is not None and result.confidence > 0.2:
+        tx, ty = estimator.position
+        px.set_visualselfposition(tx, ty)
+
+running this module prints the cost per frame at several resolutions:
+
+python drift.py
+"""
+
+import collections
+
+import numpy
+import cv2
+
+from phenox_client import (
+    PX_CAM_DATA_SHAPE, PX_CAM_FOCAL_LENGTH, monotonic_clock
+    )
+
+#dx, dy: translation of the image content [px of the input frame]
+#tx, ty: translation of the vehicle [cm] (None without height)
+#confidence: correlation peak height in [0, 1]
+DriftResult = collections.namedtuple(
+    "DriftResult", ["dx", "dy", "tx", "ty", "confidence"])
+
+
+class PhaseCorrelationDrift(object):
+    """estimate translation between consecutive frames
+
+    size: (width, height) of the downsampled image used for correlation
+    focal_length: focal length of the input frame [px]
+    min_confidence: results below this are not added to 'position'
+    axis_sign: (sign x, sign y) to convert image motion to vehicle motion;
+        depends on how the camera is mounted
+    """
+
+    def __init__(self, size=(80, 60), focal_length=PX_CAM_FOCAL_LENGTH,
+                 min_confidence=0.1, axis_sign=(-1.0, -1.0)):
+        self.size = size
+        self.focal_length = focal_length
+        self.min_confidence = min_confidence
+        self.axis_sign = axis_sign
+        w, h = size
+        #cached between calls: window, work buffer and last spectrum
+        self._window = numpy.outer(
+            numpy.hanning(h), numpy.hanning(w)).astype(numpy.float32)
+        self._work = numpy.empty((h, w), numpy.float32)
+        self._prev_spectrum = None
+        self._scale = None
+        self.position = (0.0, 0.0)
+
+    def reset(self, position=(0.0, 0.0)):
+        """forget the previous frame and set accumulated position [cm]"""
+        self._prev_spectrum = None
+        self.position = (float(position[0]), float(position[1]))
+
+    def _spectrum(self, frame):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        fh, fw = frame.shape
+        w, h = self.size
+        self._scale = (float(fw) / w, float(fh) / h)
+        small = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        work = self._work
+        work[...] = small
+        #remove DC so that the window does not create a false peak
+        work -= work.mean()
+        work *= self._window
+        return numpy.fft.rfft2(work)
+
+    def update(self, frame, height=None):
+        """return DriftResult from the previous frame, or None for the first
+
+        frame: BGR or grayscale ndarray (e.g. from 'get_image')
+        height: height above the floor [cm] to convert pixels to cm
+        """
+        spectrum = self._spectrum(frame)
+        prev = self._prev_spectrum
+        self._prev_spectrum = spectrum
+        if prev is None:
+            return None
+
+        cross = spectrum * numpy.conj(prev)
+        magnitude = numpy.abs(cross)
+        magnitude[magnitude < 1e-12] = 1e-12
+        cross /= magnitude
+        corr = numpy.fft.irfft2(cross, s=self._work.shape)
+
+        h, w = corr.shape
+        peak = int(numpy.argmax(corr))
+        py, px = divmod(peak, w)
+        confidence = float(corr[py, px])
+        #sub-pixel peak by parabola fit
+        sx = _parabola(corr[py, (px - 1) % w], corr[py, px],
+                       corr[py, (px + 1) % w])
+        sy = _parabola(corr[(py - 1) % h, px], corr[py, px],
+                       corr[(py + 1) % h, px])
+        #wrap around to negative shifts
+        if px > w // 2:
+            px -= w
+        if py > h // 2:
+            py -= h
+        #python float: numpy scalars are rejected by ctypes setters
+        dx = float((px + sx) * self._scale[0])
+        dy = float((py + sy) * self._scale[1])
+
+        tx = ty = None
+        if height is not None and height > 0:
+            cm_per_px = height / self.focal_length
+            tx = float(self.axis_sign[0] * dx * cm_per_px)
+            ty = float(self.axis_sign[1] * dy * cm_per_px)
+            if confidence >= self.min_confidence:
+                self.position = (self.position[0] + tx,
+                                 self.position[1] + ty)
+        return DriftResult(dx, dy, tx, ty, confidence)
+
+
+def _parabola(left, center, right):
+    """return offset of the peak of parabola through 3 points"""
+    denominator = left - 2.0 * center + right
+    if denominator == 0:
+        return 0.0
+    return 0.5 * (left - right) / denominator
+
+
+def benchmark(sizes=((40, 30), (80, 60), (160, 120), (320, 240)),
+              frames=200, shift=(3, 2)):
+    """return list of (size, msec per frame, estimated (dx, dy))"""
+    h, w = PX_CAM_DATA_SHAPE[:2]
+    rng = numpy.random.RandomState(0)
+    floor = cv2.GaussianBlur(
+        rng.randint(0, 256, (h + 64, w + 64)).astype(numpy.uint8),
+        (5, 5), 0)
+    images = [
+        floor[32 + i % 2 * shift[1]:32 + i % 2 * shift[1] + h,
+              32 + i % 2 * shift[0]:32 + i % 2 * shift[0] + w]
+        for i in range(2)
+    ]
+    images = [cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) for img in images]
+
+    results = []
+    for size in sizes:
+        estimator = PhaseCorrelationDrift(size)
+        estimator.update(images[0])
+        started = monotonic_clock()
+        for i in range(frames):
+            result = estimator.update(images[(i + 1) % 2])
+        elapsed = monotonic_clock() - started
+        results.append((size, elapsed / frames * 1000.0,
+                        (result.dx, result.dy)))
+    return results
+
+
+def main():
+    print("size      | msec/frame | last (dx, dy)")
+    for size, msec, (dx, dy) in benchmark():
+        print("{0:>4}x{1:<4} | {2:10.3f} | ({3:+.2f}, {4:+.2f})".format(
+            size[0], size[1], msec, dx, dy))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""square fiducial marker detector for precision landing.
+
+a marker is a black square with a white quiet zone around it and a
+grid of black/white data cells inside a black border (ArUco style).
+'generate_marker' draws markers of 'default_dictionary' to print them.
+
+FiducialDetector returns id, corners and pose of the markers in
+PX_BOTTOM_CAM frames. after a marker is found, only a region predicted
+from the last corners and SelfState velocity is searched, and a full-frame
+scan is done again after 'miss_limit' misses, so detection usually costs
+only a small part of the frame.
+
+usage:
+
+detector = FiducialDetector(marker_size=15.0)
+st = px.SelfState()
+while True:
+    img = px.get_image(px.PX_BOTTOM_CAM, 'ndarray')
+    if img is None:
+        continue
+    px.get_selfstate(st)
+    for marker in detector.detect(img, st):
+        print(marker.id, marker.tvec.ravel())
+"""
+
+import random
+
+import numpy
+import cv2
+
+from phenox_client import (
+    PX_CAM_DATA_SHAPE, PX_CAM_FOCAL_LENGTH, monotonic_clock
+    )
+
+#number of data cells in a row/column
+MARKER_BITS = 4
+#number of cells in a row/column including the black border
+MARKER_CELLS = MARKER_BITS + 2
+
+
+def _rotations_of_grid(grid):
+    return [numpy.rot90(grid, -r) for r in range(4)]
+
+
+def _rotations(code):
+    """return the 4 rotated bit grids of code (MARKER_BITS x MARKER_BITS)"""
+    bits = numpy.array(
+        [(code >> i) & 1 for i in range(MARKER_BITS * MARKER_BITS)],
+        numpy.uint8).reshape(MARKER_BITS, MARKER_BITS)
+    return _rotations_of_grid(bits)
+
+
+def make_dictionary(count=32, min_distance=4, seed=0):
+    """return list of bit grids with large hamming distance
+
+    distance is checked among all rotations, so the marker id and
+    its rotation are decoded uniquely.
+    """
+    rng = random.Random(seed)
+    candidates = list(range(1 << (MARKER_BITS * MARKER_BITS)))
+    rng.shuffle(candidates)
+    accepted = []
+    for code in candidates:
+        rots = _rotations(code)
+        #a rotation of itself must not be confused with the marker
+        if any(numpy.count_nonzero(rots[0] != r) < min_distance
+               for r in rots[1:]):
+            continue
+        if all(numpy.count_nonzero(rots[0] != r) >= min_distance
+               for grid in accepted for r in _rotations_of_grid(grid)):
+            accepted.append(rots[0])
+            if len(accepted) >= count:
+                break
+    return accepted
+
+
+_default_dictionary = []
+
+
+def default_dictionary():
+    """return the dictionary used when none is given (built on first use)"""
+    if not _default_dictionary:
+        _default_dictionary.extend(make_dictionary())
+    return _default_dictionary
+
+
+def generate_marker(marker_id, cell_px=20, dictionary=None):
+    """return uint8 image of the marker with one cell white quiet zone"""
+    if dictionary is None:
+        dictionary = default_dictionary()
+    grid = numpy.zeros((MARKER_CELLS, MARKER_CELLS), numpy.uint8)
+    grid[1:-1, 1:-1] = dictionary[marker_id]
+    grid = numpy.pad(grid, 1, "constant", constant_values=1)
+    return (numpy.kron(grid, numpy.ones((cell_px, cell_px))) * 255
+            ).astype(numpy.uint8)
+
+
+class Marker(object):
+    """detected marker
+
+    id: index in the dictionary
+    corners: float32 ndarray (4, 2) of image points;
+        top-left, top-right, bottom-right, bottom-left of the marker
+    rvec, tvec: pose of the marker in camera coordinates
+        (tvec unit is same as 'marker_size'), None if not estimated
+    """
+
+    def __init__(self, marker_id, corners, rvec=None, tvec=None):
+        self.id = marker_id
+        self.corners = corners
+        self.rvec = rvec
+        self.tvec = tvec
+
+    def center(self):
+        return self.corners.mean(axis=0)
+
+
+class FiducialDetector(object):
+    """detect square fiducial markers with predicted region search
+
+    marker_size: edge length of the black square [cm]
+    camera_matrix: 3x3 intrinsic matrix (None uses PX_CAM_FOCAL_LENGTH)
+    dist_coeffs: distortion coefficients (None means no distortion)
+    dictionary: list of bit grids (None uses 'default_dictionary')
+    miss_limit: number of missed region searches before full-frame scan
+    roi_margin: margin added around the predicted marker box,
+        relative to the marker box size
+    min_side: minimum side length of a marker [px]
+    velocity_sign: (sign x, sign y) to convert vision_vx/vy to image
+        motion of the floor; depends on how the camera is mounted
+    """
+
+    def __init__(self, marker_size=15.0, camera_matrix=None,
+                 dist_coeffs=None, dictionary=None,
+                 miss_limit=5, roi_margin=0.5, min_side=12,
+                 velocity_sign=(-1.0, -1.0), image_shape=PX_CAM_DATA_SHAPE):
+        if camera_matrix is None:
+            h, w = image_shape[:2]
+            camera_matrix = numpy.array([
+                [PX_CAM_FOCAL_LENGTH, 0.0, w / 2.0],
+                [0.0, PX_CAM_FOCAL_LENGTH, h / 2.0],
+                [0.0, 0.0, 1.0]])
+        self.camera_matrix = numpy.asarray(camera_matrix, numpy.float64)
+        self.dist_coeffs = (numpy.zeros(5) if dist_coeffs is None
+                            else numpy.asarray(dist_coeffs, numpy.float64))
+        self.marker_size = marker_size
+        if dictionary is None:
+            dictionary = default_dictionary()
+        self.dictionary = dictionary
+        self._codes = [_rotations_of_grid(g) for g in dictionary]
+        self.miss_limit = miss_limit
+        self.roi_margin = roi_margin
+        self.min_side = min_side
+        self.velocity_sign = velocity_sign
+
+        half = marker_size / 2.0
+        self._object_points = numpy.array([
+            [-half, half, 0.0], [half, half, 0.0],
+            [half, -half, 0.0], [-half, -half, 0.0]], numpy.float32)
+        self._warp_size = MARKER_CELLS * 6
+        self._warp_dst = numpy.array([
+            [0, 0], [self._warp_size, 0],
+            [self._warp_size, self._warp_size], [0, self._warp_size]],
+            numpy.float32)
+        self.reset()
+
+    def reset(self):
+        """forget tracked markers and statistics"""
+        self._last_corners = None
+        self._last_time = None
+        self.misses = 0
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.last_roi = None
+
+    def detect(self, frame, state=None, t=None):
+        """return list(Marker) found in frame
+
+        frame: BGR or grayscale ndarray
+        state: SelfState at capture time (used for ROI prediction)
+        t: capture time [s] (None uses current monotonic clock)
+        """
+        if t is None:
+            t = monotonic_clock()
+        gray = frame if frame.ndim == 2 else \
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        roi = None
+        if self._last_corners is not None and self.misses < self.miss_limit:
+            roi = self._predict_roi(gray.shape, state, t)
+        self.last_roi = roi
+
+        if roi is not None:
+            self.roi_scans += 1
+            x0, y0, x1, y1 = roi
+            markers = self._detect_in(gray[y0:y1, x0:x1], (x0, y0))
+            if not markers:
+                self.misses += 1
+                if self.misses >= self.miss_limit:
+                    #give up tracking; full-frame scan from next frame
+                    self._last_corners = None
+                return []
+        else:
+            self.full_scans += 1
+            markers = self._detect_in(gray, (0, 0))
+            if not markers:
+                return []
+
+        self.misses = 0
+        self._last_corners = numpy.concatenate(
+            [m.corners for m in markers])
+        self._last_time = t
+        for m in markers:
+            self._estimate_pose(m)
+        return markers
+
+    def _predict_roi(self, shape, state, t):
+        """return (x0, y0, x1, y1) of the region to search"""
+        corners = self._last_corners
+        x0, y0 = corners.min(axis=0)
+        x1, y1 = corners.max(axis=0)
+        if state is not None and state.height > 0:
+            dt = t - self._last_time
+            #floor motion on the image [px]
+            scale = self.camera_matrix[0, 0] / state.height * dt
+            dx = self.velocity_sign[0] * state.vision_vx * scale
+            dy = self.velocity_sign[1] * state.vision_vy * scale
+            x0, x1 = x0 + dx, x1 + dx
+            y0, y1 = y0 + dy, y1 + dy
+        margin = self.roi_margin * max(x1 - x0, y1 - y0) + self.min_side
+        h, w = shape[:2]
+        x0 = int(max(0, x0 - margin))
+        y0 = int(max(0, y0 - margin))
+        x1 = int(min(w, x1 + margin + 1))
+        y1 = int(min(h, y1 + margin + 1))
+        if x1 - x0 < self.min_side or y1 - y0 < self.min_side:
+            return (0, 0, w, h)
+        return (x0, y0, x1, y1)
+
+    def _detect_in(self, gray, offset):
+        block = max(3, (min(gray.shape[:2]) // 8) | 1)
+        binary = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY_INV, block, 7)
+        #findContours returns 2 or 3 values depending on OpenCV version
+        contours = cv2.findContours(
+            binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        markers = []
+        min_perimeter = 4 * self.min_side
+        for contour in contours:
+            perimeter = cv2.arcLength(contour, True)
+            if perimeter < min_perimeter:
+                continue
+            quad = cv2.approxPolyDP(contour, 0.05 * perimeter, True)
+            if len(quad) != 4 or not cv2.isContourConvex(quad):
+                continue
+            corners = quad.reshape(4, 2).astype(numpy.float32)
+            #make the order clockwise in image coordinates
+            d1, d2 = corners[1] - corners[0], corners[2] - corners[0]
+            if d1[0] * d2[1] - d1[1] * d2[0] < 0:
+                corners = corners[::-1].copy()
+            marker = self._decode(gray, corners)
+            if marker is not None:
+                marker.corners += offset
+                markers.append(marker)
+        return self._unique(markers)
+
+    def _decode(self, gray, corners):
+        matrix = cv2.getPerspectiveTransform(corners, self._warp_dst)
+        size = self._warp_size
+        warped = cv2.warpPerspective(gray, matrix, (size, size))
+        cell = size // MARKER_CELLS
+        #mean of the center part of each cell
+        cells = warped.reshape(MARKER_CELLS, cell, MARKER_CELLS, cell)[
+            :, 1:-1, :, 1:-1].mean(axis=(1, 3))
+        threshold = (cells.max() + cells.min()) / 2.0
+        if cells.max() - cells.min() < 30:
+            return None
+        bits = (cells > threshold).astype(numpy.uint8)
+        border = numpy.concatenate(
+            [bits[0], bits[-1], bits[:, 0], bits[:, -1]])
+        if border.any():
+            return None
+        data = bits[1:-1, 1:-1]
+        for marker_id, rotations in enumerate(self._codes):
+            for r, grid in enumerate(rotations):
+                if (data == grid).all():
+                    #corners[r] is the top-left corner of the marker
+                    return Marker(marker_id, numpy.roll(corners, -r, axis=0))
+        return None
+
+    def _unique(self, markers):
+        """drop the same marker found twice (inner/outer contour)"""
+        result = []
+        for m in markers:
+            if all(o.id != m.id or
+                   numpy.abs(o.center() - m.center()).max() > self.min_side
+                   for o in result):
+                result.append(m)
+        return result
+
+    def _estimate_pose(self, marker):
+        flags = getattr(cv2, "SOLVEPNP_IPPE_SQUARE", None)
+        if flags is None:
+            ok, rvec, tvec = cv2.solvePnP(
+                self._object_points, marker.corners,
+                self.camera_matrix, self.dist_coeffs)
+        else:
+            ok, rvec, tvec = cv2.solvePnP(
+                self._object_points, marker.corners,
+                self.camera_matrix, self.dist_coeffs, flags=flags)
+        if ok:
+            marker.rvec, marker.tvec = rvec, tvec
+
+    def get_stats(self):
+        """return dict of scan statistics"""
+        return {
+            "full_scans": self.full_scans,
+            "roi_scans": self.roi_scans,
+            "misses": self.misses
+        }
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""multi-vehicle simulation harness.
+
+each simulated vehicle runs in its own worker process with a
+'phenox_client.Phenox' instance wrapping 'phenox_sim.SimBackend'.
+vehicles share their states through a shared memory array, so
+coordination logic can read the states of the other vehicles.
+
+a controller is a function called once per tick in each worker:
+
+def controller(phenox, vehicle_id, tick, peers):
+    #phenox: Phenox instance of this vehicle
+    #peers: list of (vehicle_id, tx, ty, height, mode) of all vehicles
+    ...
+
+run_fleet(4, controller, duration=5.0) returns per-vehicle results,
+and running this module prints how the aggregate tick rate
+scales with the number of vehicles:
+
+python fleet.py 1 2 4 8
+"""
+
+import multiprocessing
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from phenox_client import (
+    Phenox, SelfState, PX_HALT, PX_UP, PX_HOVER, monotonic_clock
+    )
+from phenox_sim import SimBackend
+
+#columns of a vehicle row in the shared state array
+PEER_FIELDS = ("tx", "ty", "height", "mode")
+
+
+def formation_controller(phenox, vehicle_id, tick, peers):
+    """sample controller: take off and line up 50cm apart
+
+    each vehicle keeps 50cm spacing from the centroid of all vehicles.
+    """
+    mode = phenox.get_operate_mode()
+    if mode == PX_HALT and tick == 0:
+        phenox.set_rangecontrol_z(100.0)
+        phenox.set_operate_mode(PX_UP)
+    elif mode == PX_HOVER:
+        n = len(peers)
+        cx = sum(p[1] for p in peers) / n
+        cy = sum(p[2] for p in peers) / n
+        offset = 50.0 * (vehicle_id - (n - 1) / 2.0)
+        phenox.set_visioncontrol_xy(cx + offset, cy)
+
+
+def _read_peers(shared, n):
+    with shared.get_lock():
+        values = shared[:]
+    width = len(PEER_FIELDS)
+    return [
+        tuple([i] + values[i * width:(i + 1) * width])
+        for i in range(n)
+    ]
+
+
+def _worker(vehicle_id, n, shared, results, controller,
+            duration, tick_interval, sim_dt):
+    try:
+        results.put(_run_vehicle(vehicle_id, n, shared, controller,
+                                 duration, tick_interval, sim_dt))
+    except Exception:
+        results.put({
+            "vehicle_id": vehicle_id,
+            "error": traceback.format_exc()
+        })
+
+
+def _run_vehicle(vehicle_id, n, shared, controller,
+                 duration, tick_interval, sim_dt):
+    backend = SimBackend(seed=vehicle_id)
+    #spread the vehicles so that they do not start at the same point
+    backend.tx = 30.0 * vehicle_id
+    phenox = Phenox(backend)
+    phenox.initialize()
+
+    st = SelfState()
+    width = len(PEER_FIELDS)
+    row = vehicle_id * width
+    tick = 0
+    started = monotonic_clock()
+    deadline = started + duration
+    next_tick = started
+    while True:
+        now = monotonic_clock()
+        if now >= deadline:
+            break
+        if tick_interval:
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            next_tick += tick_interval
+
+        peers = _read_peers(shared, n)
+        phenox.set_keepalive()
+        controller(phenox, vehicle_id, tick, peers)
+        backend.step(sim_dt)
+
+        phenox.get_selfstate(st)
+        with shared.get_lock():
+            shared[row:row + width] = [
+                st.vision_tx, st.vision_ty, st.height,
+                float(phenox.get_operate_mode())
+            ]
+        tick += 1
+
+    elapsed = monotonic_clock() - started
+    phenox.get_selfstate(st)
+    return {
+        "vehicle_id": vehicle_id,
+        "ticks": tick,
+        "elapsed": elapsed,
+        "tx": st.vision_tx,
+        "ty": st.vision_ty,
+        "height": st.height,
+        "mode": phenox.get_operate_mode()
+    }
+
+
+def run_fleet(n, controller=formation_controller, duration=2.0,
+              tick_interval=None, sim_dt=0.01):
+    """run n simulated vehicles in worker processes
+
+    controller: function(phenox, vehicle_id, tick, peers) called every tick
+    duration: wall clock time to run [s]
+    tick_interval: wall clock period of a tick [s]
+        (None means sim_dt, so that simulated time of all vehicles
+        advances in real time and peer states are time-aligned;
+        0 runs as fast as possible, only for throughput measurement)
+    sim_dt: simulated time advanced per tick [s]
+
+    return list of result dict sorted by vehicle_id.
+    RuntimeError is raised if a worker fails or does not report in time.
+    """
+    if tick_interval is None:
+        tick_interval = sim_dt
+    shared = multiprocessing.Array("d", n * len(PEER_FIELDS))
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_worker,
+            args=(i, n, shared, results, controller,
+                  duration, tick_interval, sim_dt)
+        )
+        for i in range(n)
+    ]
+    for w in workers:
+        w.start()
+    #get results before join, otherwise a full queue blocks the workers
+    collected = []
+    deadline = monotonic_clock() + duration + 10.0
+    try:
+        while len(collected) < n:
+            try:
+                collected.append(results.get(timeout=0.5))
+            except queue.Empty:
+                dead = [w for w in workers
+                        if w.exitcode is not None and w.exitcode != 0]
+                if dead or monotonic_clock() > deadline:
+                    raise RuntimeError(
+                        "fleet worker did not report (exit codes: {0})".format(
+                            [w.exitcode for w in workers]))
+    finally:
+        for w in workers:
+            w.join(1.0)
+            if w.is_alive():
+                w.terminate()
+                w.join()
+
+    errors = [r for r in collected if "error" in r]
+    if errors:
+        raise RuntimeError("vehicle {0} failed:\n{1}".format(
+            errors[0]["vehicle_id"], errors[0]["error"]))
+    return sorted(collected, key=lambda r: r["vehicle_id"])
+
+
+def aggregate_tick_rate(results):
+    """return total ticks per second of all vehicles"""
+    return sum(r["ticks"] / r["elapsed"] for r in results)
+
+
+def measure_scaling(counts, controller=formation_controller, duration=2.0):
+    """return list of (vehicle count, aggregate tick rate)
+
+    vehicles run as fast as possible (not time-aligned).
+    """
+    return [
+        (n, aggregate_tick_rate(
+            run_fleet(n, controller, duration, tick_interval=0)))
+        for n in counts
+    ]
+
+
+def main():
+    import sys
+
+    counts = [int(v) for v in sys.argv[1:]] or [1, 2, 4, 8]
+    print("vehicles | aggregate ticks/s | ticks/s per vehicle")
+    for n, rate in measure_scaling(counts):
+        print("{0:8d} | {1:17.1f} | {2:.1f}".format(n, rate, rate / n))
+
+if __name__ == "__main__":
+    main()
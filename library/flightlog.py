@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+"""columnar flight log for post-flight analysis.
+
+a flight log is a directory which contains compressed chunks and an index.
+
+    index.json          : list of chunks with row count and time range
+    state_00000.npz ... : SelfState fields and operate mode per tick
+    event_00000.npz ... : setter commands and other events
+
+each column is stored as a separate member of the .npz archive, so
+FlightLogReader loads only the requested columns of the chunks
+which overlap the requested time range.
+
+usage(in flight):
+
+log = FlightLogWriter("/mnt/log/flight01")
+st = px.SelfState()
+...
+    px.get_selfstate(st)
+    log.log_state(st, px.get_operate_mode())
+    log.log_command("set_operate_mode", px.PX_DOWN)
+...
+log.close()
+
+usage(offline):
+
+reader = FlightLogReader("flight01")
+data = reader.query(["t", "height"], t_start=10.0, t_end=20.0)
+
+or from the command line:
+
+python flightlog.py flight01 -c t,degz,height -s 10 -e 20
+
+the unit of 't' is second from the log creation (monotonic clock).
+"""
+
+import json
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+#not phenox_client: the reader runs on the ground PC without OpenCV
+from monotonic import monotonic_clock
+
+#same order as phenox.SelfState._fields_
+STATE_FIELDS = [
+    "degx",
+    "degy",
+    "degz",
+    "vision_tx",
+    "vision_ty",
+    "vision_tz",
+    "vision_vx",
+    "vision_vy",
+    "vision_vz",
+    "height",
+    "battery"
+]
+
+STATE_COLUMNS = (
+    [("t", numpy.float64)] +
+    [(name, numpy.float32) for name in STATE_FIELDS[:-1]] +
+    [("battery", numpy.int32), ("mode", numpy.int8)]
+)
+
+EVENT_COLUMNS = ["t", "kind", "name", "value"]
+
+INDEX_FILENAME = "index.json"
+
+
+class FlightLogWriter(object):
+    """write flight log incrementally
+
+    directory: output directory (created if not exists)
+    chunk_size: number of state rows in one chunk
+    event_chunk_size: number of events in one chunk
+
+    state rows are kept in preallocated column arrays. when chunk_size
+    rows are filled, the arrays are handed to a writer thread which
+    compresses them and updates the index, and a spare set of arrays
+    is used for the next rows. so the cost per tick is only some array
+    assignments.
+
+    an error on the writer thread (e.g. disk full) is raised by the next
+    'log_*', 'flush' or 'close' call; the writer keeps consuming chunks
+    so that these calls never wait forever.
+    """
+
+    def __init__(self, directory, chunk_size=1000, event_chunk_size=200):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.event_chunk_size = event_chunk_size
+        self._t0 = monotonic_clock()
+        self._index = {"version": 1, "state": [], "event": []}
+        #column arrays returned by the writer thread for reuse
+        self._spare = queue.Queue()
+        self._columns = self._new_columns()
+        #one spare set so that the first hand-off does not allocate
+        self._spare.put(self._new_columns())
+        self._rows = 0
+        self._events = []
+        self._closed = False
+        self._error = None
+        self._write_index()
+        self._jobs = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _new_columns(self):
+        try:
+            return self._spare.get_nowait()
+        except queue.Empty:
+            return dict(
+                (name, numpy.zeros(self.chunk_size, dtype))
+                for name, dtype in STATE_COLUMNS
+            )
+
+    def now(self):
+        """return current log time in second"""
+        return monotonic_clock() - self._t0
+
+    def _check(self):
+        if self._closed:
+            raise ValueError("flight log is already closed")
+        self._raise_error()
+
+    def _raise_error(self):
+        error = self._error
+        if error is not None:
+            self._error = None
+            raise error
+
+    def log_state(self, state, mode=-1, t=None):
+        """append SelfState (and operate mode) as one row"""
+        self._check()
+        i = self._rows
+        cols = self._columns
+        cols["t"][i] = self.now() if t is None else t
+        for name in STATE_FIELDS:
+            cols[name][i] = getattr(state, name)
+        cols["mode"][i] = mode
+        self._rows += 1
+        if self._rows >= self.chunk_size:
+            self._queue_state()
+
+    def log_command(self, name, *args, **kwargs):
+        """append setter command (e.g. "set_operate_mode", PX_DOWN)
+
+        keyword argument t gives the time in the same time base
+        as 'log_state' (None uses 'now').
+        """
+        self._append_event("command", name, args, kwargs.get("t"))
+
+    def log_event(self, name, *args, **kwargs):
+        """append any other event (e.g. "whistle")
+
+        keyword argument t is same as 'log_command'.
+        """
+        self._append_event("event", name, args, kwargs.get("t"))
+
+    def _append_event(self, kind, name, args, t):
+        self._check()
+        value = ",".join(str(v) for v in args)
+        self._events.append(
+            (self.now() if t is None else float(t), kind, name, value))
+        if len(self._events) >= self.event_chunk_size:
+            self._queue_event()
+
+    def flush(self):
+        """write buffered rows and events and wait until they are written"""
+        self._queue_state()
+        self._queue_event()
+        self._jobs.join()
+        self._raise_error()
+
+    def close(self):
+        """flush and close the log"""
+        if not self._closed:
+            try:
+                self.flush()
+            finally:
+                self._closed = True
+                self._jobs.put(None)
+                self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _queue_state(self):
+        if self._rows == 0:
+            return
+        self._jobs.put(("state", self._columns, self._rows))
+        self._columns = self._new_columns()
+        self._rows = 0
+
+    def _queue_event(self):
+        if not self._events:
+            return
+        self._jobs.put(("event", self._events, len(self._events)))
+        self._events = []
+
+    def _write_loop(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                kind, data, n = job
+                if kind == "state":
+                    try:
+                        self._write_state(data, n)
+                    finally:
+                        self._spare.put(data)
+                else:
+                    self._write_event(data)
+            except Exception as error:
+                #keep consuming jobs; raised in the caller's thread
+                if self._error is None:
+                    self._error = error
+            finally:
+                self._jobs.task_done()
+
+    def _write_state(self, columns, n):
+        t = columns["t"]
+        filename = "state_{0:05d}.npz".format(len(self._index["state"]))
+        numpy.savez_compressed(
+            os.path.join(self.directory, filename),
+            **dict((name, col[:n]) for name, col in columns.items())
+        )
+        self._index["state"].append({
+            "file": filename,
+            "rows": n,
+            "t_min": float(t[0]),
+            "t_max": float(t[n - 1])
+        })
+        self._write_index()
+
+    def _write_event(self, events):
+        t, kind, name, value = zip(*events)
+        filename = "event_{0:05d}.npz".format(len(self._index["event"]))
+        numpy.savez_compressed(
+            os.path.join(self.directory, filename),
+            t=numpy.array(t, numpy.float64),
+            kind=numpy.array(kind, numpy.str_),
+            name=numpy.array(name, numpy.str_),
+            value=numpy.array(value, numpy.str_)
+        )
+        self._index["event"].append({
+            "file": filename,
+            "rows": len(t),
+            "t_min": float(t[0]),
+            "t_max": float(t[-1])
+        })
+        self._write_index()
+
+    def _write_index(self):
+        #write to temporary file and rename it
+        #so that the index is valid even if power is lost
+        path = os.path.join(self.directory, INDEX_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.rename(tmp_path, path)
+
+
+class FlightLogReader(object):
+    """query columns of a flight log written by FlightLogWriter"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILENAME)) as f:
+            self._index = json.load(f)
+
+    def columns(self, stream="state"):
+        """return available column names of the stream"""
+        if stream == "state":
+            return [name for name, _ in STATE_COLUMNS]
+        elif stream == "event":
+            return list(EVENT_COLUMNS)
+        else:
+            raise ValueError("stream must be 'state' or 'event'")
+
+    def time_range(self, stream="state"):
+        """return (t_min, t_max) of the stream, or None if empty"""
+        chunks = self._index[stream]
+        if not chunks:
+            return None
+        return (chunks[0]["t_min"], chunks[-1]["t_max"])
+
+    def query(self, columns=None, t_start=None, t_end=None, stream="state"):
+        """return dict of ndarray for requested columns and time range
+
+        columns: list of column names (None means all columns)
+        t_start, t_end: time range in second (None means unbounded)
+        stream: 'state' or 'event'
+        """
+        available = self.columns(stream)
+        if columns is None:
+            columns = available
+        for name in columns:
+            if name not in available:
+                raise ValueError("unknown column '{0}'".format(name))
+
+        need_t = t_start is not None or t_end is not None
+        parts = dict((name, []) for name in columns)
+        for chunk in self._index[stream]:
+            if t_start is not None and chunk["t_max"] < t_start:
+                continue
+            if t_end is not None and chunk["t_min"] > t_end:
+                continue
+            path = os.path.join(self.directory, chunk["file"])
+            with numpy.load(path) as npz:
+                mask = None
+                if need_t:
+                    t = npz["t"]
+                    mask = numpy.ones(len(t), bool)
+                    if t_start is not None:
+                        mask &= t >= t_start
+                    if t_end is not None:
+                        mask &= t <= t_end
+                for name in columns:
+                    col = npz[name]
+                    parts[name].append(col if mask is None else col[mask])
+
+        result = {}
+        for name in columns:
+            if parts[name]:
+                result[name] = numpy.concatenate(parts[name])
+            else:
+                result[name] = numpy.array([])
+        return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="query Phenox flight log")
+    parser.add_argument("directory")
+    parser.add_argument("-c", "--columns", default=None,
+                        help="comma separated column names")
+    parser.add_argument("-s", "--start", type=float, default=None)
+    parser.add_argument("-e", "--end", type=float, default=None)
+    parser.add_argument("--events", action="store_true",
+                        help="query command/event stream")
+    args = parser.parse_args()
+
+    reader = FlightLogReader(args.directory)
+    stream = "event" if args.events else "state"
+    columns = args.columns.split(",") if args.columns else None
+    data = reader.query(columns, args.start, args.end, stream)
+    columns = columns or reader.columns(stream)
+
+    print(",".join(columns))
+    for row in zip(*[data[name] for name in columns]):
+        print(",".join(str(v) for v in row))
+
+if __name__ == "__main__":
+    main()
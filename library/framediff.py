@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""cheap change detection for camera frames.
+
+while Phenox is hovering, the bottom camera keeps seeing almost
+the same floor, so running feature or blob processing on every frame
+obtained by 'phenox.get_image' wastes CPU time.
+FrameChangeDetector compares a small signature of each frame with the
+signature of the last processed frame and tells whether the downstream
+stages have to run.
+
+usage:
+
+detector = FrameChangeDetector(threshold=6.0, refresh_interval=30)
+while True:
+    img = px.get_image(px.PX_BOTTOM_CAM, 'ndarray')
+    if img is None:
+        continue
+    if detector.update(img):
+        #heavy vision processing here
+        pass
+print(detector.get_stats())
+
+two signature methods are available:
+    'mean': mean absolute difference of downsampled grayscale images
+            (threshold unit: pixel intensity, 0 - 255)
+    'dhash': hamming distance of 64 bit difference hash
+            (threshold unit: number of different bits, 0 - 64)
+"""
+
+import numpy
+
+#default size of the downsampled signature image (height, width)
+DEFAULT_SIGNATURE_SHAPE = (15, 20)
+
+
+def _to_gray(img):
+    """return float32 grayscale image from (h, w, 3) or (h, w) ndarray"""
+    img = numpy.asarray(img)
+    if img.ndim == 3:
+        #BGR order as used by OpenCV
+        return (img[:, :, 0] * 0.114 +
+                img[:, :, 1] * 0.587 +
+                img[:, :, 2] * 0.299).astype(numpy.float32)
+    else:
+        return img.astype(numpy.float32)
+
+
+def _block_mean(gray, shape):
+    """downsample 2D array to 'shape' by averaging blocks.
+
+    the edges which do not fill a whole block are cropped.
+    """
+    out_h, out_w = shape
+    h, w = gray.shape
+    bh, bw = h // out_h, w // out_w
+    if bh == 0 or bw == 0:
+        raise ValueError("signature shape is larger than the frame")
+    cropped = gray[:bh * out_h, :bw * out_w]
+    return cropped.reshape(out_h, bh, out_w, bw).mean(axis=(1, 3))
+
+
+def mean_signature(img, shape=DEFAULT_SIGNATURE_SHAPE):
+    """return downsampled grayscale image used as a frame signature"""
+    return _block_mean(_to_gray(img), shape)
+
+
+def dhash_signature(img):
+    """return 64 bit difference hash as bool ndarray (8, 8)"""
+    small = _block_mean(_to_gray(img), (8, 9))
+    return small[:, 1:] > small[:, :-1]
+
+
+class FrameChangeDetector(object):
+    """decide whether a frame differs enough from the last processed one
+
+    threshold: minimum distance to treat the frame as 'changed'
+    refresh_interval: force processing after this number of
+        consecutive skipped frames (0 or None disables forced refresh)
+    method: 'mean' or 'dhash'
+    shape: signature shape for 'mean' method
+    """
+
+    def __init__(self, threshold=6.0, refresh_interval=30,
+                 method='mean', shape=DEFAULT_SIGNATURE_SHAPE):
+        if method not in ('mean', 'dhash'):
+            raise ValueError("method must be 'mean' or 'dhash'")
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.method = method
+        self.shape = shape
+        self.reset()
+
+    def reset(self):
+        """forget the reference frame and clear statistics"""
+        self._reference = None
+        self._skipped_in_row = 0
+        self.last_distance = None
+        self.frames = 0
+        self.skipped = 0
+        self.forced = 0
+
+    def signature(self, img):
+        """return signature of img according to the selected method"""
+        if self.method == 'dhash':
+            return dhash_signature(img)
+        else:
+            return mean_signature(img, self.shape)
+
+    def distance(self, sig_a, sig_b):
+        """return distance between two signatures"""
+        if self.method == 'dhash':
+            return int(numpy.count_nonzero(sig_a != sig_b))
+        else:
+            return float(numpy.abs(sig_a - sig_b).mean())
+
+    def update(self, img):
+        """return True if downstream processing should run for img
+
+        when True is returned, img becomes the new reference frame.
+        """
+        sig = self.signature(img)
+        self.frames += 1
+
+        if self._reference is None:
+            self.last_distance = None
+            return self._accept(sig)
+
+        self.last_distance = self.distance(sig, self._reference)
+        if self.last_distance >= self.threshold:
+            return self._accept(sig)
+
+        if (self.refresh_interval and
+            self._skipped_in_row >= self.refresh_interval):
+            self.forced += 1
+            return self._accept(sig)
+
+        self._skipped_in_row += 1
+        self.skipped += 1
+        return False
+
+    def _accept(self, sig):
+        self._reference = sig
+        self._skipped_in_row = 0
+        return True
+
+    def get_skip_rate(self):
+        """return ratio of skipped frames in [0.0, 1.0]"""
+        if self.frames == 0:
+            return 0.0
+        return float(self.skipped) / self.frames
+
+    def get_stats(self):
+        """return dict of statistics to measure saved processing"""
+        return {
+            "frames": self.frames,
+            "processed": self.frames - self.skipped,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "skip_rate": self.get_skip_rate()
+        }
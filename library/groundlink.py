@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+"""binary ground-control link over UDP.
+
+GroundLinkServer runs in the Phenox script. it streams SelfState,
+operate mode and battery flag to the ground station with several samples
+in one packet, and receives setpoint and mode commands.
+
+server = GroundLinkServer(px.default_phenox, ("192.168.2.1", GROUNDLINK_PORT),
+                          rate=50.0, batch=5, allowed=["192.168.2.10"])
+server.start()
+
+#in the control tick
+server.record()            #telemetry (rate limited)
+server.apply_commands()    #pending commands, never blocks
+
+GroundLinkClient runs on the ground station.
+
+client = GroundLinkClient(("192.168.2.1", GROUNDLINK_PORT))
+client.subscribe()
+client.set_rangecontrol_z(120.0)
+client.set_operate_mode(PX_UP)
+for sample in client.receive(timeout=1.0):
+    print(sample.height)
+
+packet formats (little endian):
+    telemetry: TELEMETRY_HEADER + TELEMETRY_SAMPLE * count
+    command:   COMMAND_PACKET
+
+running this module measures command latency and telemetry throughput
+over the loopback interface with a simulated vehicle:
+
+python groundlink.py [rate] [duration]
+"""
+
+import collections
+import math
+import socket
+import struct
+import threading
+import time
+
+from phenox_client import SelfState, monotonic_clock
+
+GROUNDLINK_PORT = 5760
+
+#bind to loopback unless an interface is given explicitly
+DEFAULT_ADDRESS = ("127.0.0.1", GROUNDLINK_PORT)
+
+TELEMETRY_MAGIC = b"PXTL"
+COMMAND_MAGIC = b"PXCM"
+
+#magic, sample count, sequence number
+TELEMETRY_HEADER = struct.Struct("<4sBH")
+#t, degx, degy, degz, vision_tx/ty/tz, vision_vx/vy/vz, height,
+#battery, mode, battery_low
+TELEMETRY_SAMPLE = struct.Struct("<d10fibB")
+#magic, command id, sequence number, send time, 3 arguments
+COMMAND_PACKET = struct.Struct("<4sBHd3f")
+
+#maximum samples in one telemetry packet (UDP payload < 1472 bytes)
+MAX_BATCH = (1472 - TELEMETRY_HEADER.size) // TELEMETRY_SAMPLE.size
+
+CMD_SUBSCRIBE = 0
+CMD_OPERATE_MODE = 1
+CMD_VISIONCONTROL_XY = 2
+CMD_RANGECONTROL_Z = 3
+CMD_DST_DEGX = 4
+CMD_DST_DEGY = 5
+CMD_DST_DEGZ = 6
+CMD_LED = 7
+CMD_BUZZER = 8
+
+Telemetry = collections.namedtuple("Telemetry", [
+    "t", "degx", "degy", "degz",
+    "vision_tx", "vision_ty", "vision_tz",
+    "vision_vx", "vision_vy", "vision_vz",
+    "height", "battery", "mode", "battery_low"
+])
+
+
+def pack_telemetry(seq, samples):
+    """return telemetry packet of packed samples (list of bytes)"""
+    return TELEMETRY_HEADER.pack(
+        TELEMETRY_MAGIC, len(samples), seq & 0xffff) + b"".join(samples)
+
+
+def unpack_telemetry(packet):
+    """return (seq, list(Telemetry)) or None if packet is invalid"""
+    if len(packet) < TELEMETRY_HEADER.size:
+        return None
+    magic, count, seq = TELEMETRY_HEADER.unpack_from(packet)
+    expected = TELEMETRY_HEADER.size + count * TELEMETRY_SAMPLE.size
+    if magic != TELEMETRY_MAGIC or len(packet) != expected:
+        return None
+    samples = []
+    offset = TELEMETRY_HEADER.size
+    for _ in range(count):
+        values = TELEMETRY_SAMPLE.unpack_from(packet, offset)
+        samples.append(
+            Telemetry(*(values[:-1] + (bool(values[-1]),))))
+        offset += TELEMETRY_SAMPLE.size
+    return seq, samples
+
+
+class GroundLinkServer(object):
+    """telemetry and command server running beside the control loop
+
+    phenox: phenox_client.Phenox instance (or 'phenox' module)
+    address: (host, port) to bind; give the address of the interface
+        facing the ground station
+    rate: telemetry sample rate [Hz]
+    batch: number of samples sent in one packet
+    ground: (host, port) of the ground station; if None, telemetry is
+        sent to the address of the last CMD_SUBSCRIBE packet
+    allowed: hosts (IP address strings) whose packets are accepted,
+        including CMD_SUBSCRIBE. if None, only the host of ground is
+        accepted, or any host if ground is None too.
+    max_pending: commands received while the control loop is busy
+        beyond this number are dropped (oldest first)
+    """
+
+    def __init__(self, phenox, address=DEFAULT_ADDRESS, rate=50.0, batch=5,
+                 ground=None, allowed=None, max_pending=64):
+        if not 0 < batch <= MAX_BATCH:
+            raise ValueError("batch must be in (0, {0}]".format(MAX_BATCH))
+        self.phenox = phenox
+        self.rate = rate
+        self.batch = batch
+        self.ground = ground
+        if allowed is None and ground is not None:
+            allowed = [ground[0]]
+        self.allowed = None if allowed is None else frozenset(allowed)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self._socket.settimeout(0.1)
+        self._commands = collections.deque(maxlen=max_pending)
+        self._samples = []
+        self._state = SelfState()
+        self._seq = 0
+        self._next_sample = None
+        self._thread = None
+        self._running = False
+
+        self.packets_sent = 0
+        self.commands_received = 0
+        self.commands_applied = 0
+        self.commands_rejected = 0
+        self.packets_refused = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def address(self):
+        """bound (host, port)"""
+        return self._socket.getsockname()
+
+    def start(self):
+        """start command receiver thread"""
+        if self._thread is not None:
+            raise RuntimeError("ground link is already running")
+        self._running = True
+        self._thread = threading.Thread(target=self._receive_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """stop receiver thread and close the socket"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+
+    def _receive_loop(self):
+        while self._running:
+            try:
+                packet, sender = self._socket.recvfrom(COMMAND_PACKET.size)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if self.allowed is not None and sender[0] not in self.allowed:
+                self.packets_refused += 1
+                continue
+            if len(packet) != COMMAND_PACKET.size:
+                continue
+            values = COMMAND_PACKET.unpack(packet)
+            if values[0] != COMMAND_MAGIC:
+                continue
+            self.commands_received += 1
+            if values[1] == CMD_SUBSCRIBE:
+                self.ground = sender
+            else:
+                #deque.append is thread safe
+                self._commands.append(values[1:])
+
+    def record(self, state=None, mode=None, battery_low=None):
+        """add telemetry sample if the sample interval has elapsed
+
+        state, mode and battery_low are obtained from phenox if None.
+        call this in the control tick; it never blocks.
+        return True if a sample was added.
+        """
+        now = monotonic_clock()
+        if self._next_sample is not None and now < self._next_sample:
+            return False
+        interval = 1.0 / self.rate
+        if self._next_sample is None or now - self._next_sample > interval:
+            #too late (e.g. the first sample): restart the schedule
+            self._next_sample = now + interval
+        else:
+            self._next_sample += interval
+
+        if state is None:
+            state = self._state
+            self.phenox.get_selfstate(state)
+        if mode is None:
+            mode = self.phenox.get_operate_mode()
+        if battery_low is None:
+            battery_low = self.phenox.get_battery_is_low()
+        self._samples.append(TELEMETRY_SAMPLE.pack(
+            now, state.degx, state.degy, state.degz,
+            state.vision_tx, state.vision_ty, state.vision_tz,
+            state.vision_vx, state.vision_vy, state.vision_vz,
+            state.height, state.battery, mode, int(bool(battery_low))
+        ))
+        if len(self._samples) >= self.batch:
+            self.flush()
+        return True
+
+    def flush(self):
+        """send pending telemetry samples"""
+        if not self._samples:
+            return
+        ground = self.ground
+        if ground is not None:
+            packet = pack_telemetry(self._seq, self._samples)
+            try:
+                self._socket.sendto(packet, ground)
+                self._seq += 1
+                self.packets_sent += 1
+            except socket.error:
+                pass
+        self._samples = []
+
+    def apply_commands(self, max_commands=None):
+        """apply received commands in one OperateBatch
+
+        invalid commands (unknown id, non-finite or out of range
+        arguments) are counted in commands_rejected and skipped;
+        the other commands are still applied.
+        return the number of applied commands.
+        """
+        applied = 0
+        now = monotonic_clock()
+        with self.phenox.operate() as op:
+            while self._commands:
+                if max_commands is not None and applied >= max_commands:
+                    break
+                cmd, seq, sent, a, b, c = self._commands.popleft()
+                try:
+                    _apply_command(op, cmd, a, b, c)
+                except (ValueError, OverflowError, TypeError):
+                    self.commands_rejected += 1
+                    continue
+                applied += 1
+                #valid only on loopback (same clock on both ends)
+                latency = now - sent
+                self.latency_sum += latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+        self.commands_applied += applied
+        return applied
+
+
+def _apply_command(op, cmd, a, b, c):
+    for v in (a, b, c):
+        if math.isinf(v) or math.isnan(v):
+            raise ValueError("command argument is not finite")
+    if cmd == CMD_OPERATE_MODE:
+        op.set_operate_mode(int(a))
+    elif cmd == CMD_VISIONCONTROL_XY:
+        op.set_visioncontrol_xy(a, b)
+    elif cmd == CMD_RANGECONTROL_Z:
+        op.set_rangecontrol_z(a)
+    elif cmd == CMD_DST_DEGX:
+        op.set_dst_degx(a)
+    elif cmd == CMD_DST_DEGY:
+        op.set_dst_degy(a)
+    elif cmd == CMD_DST_DEGZ:
+        op.set_dst_degz(a)
+    elif cmd == CMD_LED:
+        op.set_led(int(a), bool(b))
+    elif cmd == CMD_BUZZER:
+        op.set_buzzer(bool(a))
+    else:
+        raise ValueError("unknown command id {0}".format(cmd))
+
+
+class GroundLinkClient(object):
+    """ground station side of the ground link
+
+    server: (host, port) of GroundLinkServer
+    address: (host, port) to bind for telemetry
+    """
+
+    def __init__(self, server, address=("0.0.0.0", 0)):
+        self.server = server
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self._seq = 0
+        self.last_seq = None
+        self.lost_packets = 0
+
+    def close(self):
+        self._socket.close()
+
+    def send_command(self, cmd, a=0.0, b=0.0, c=0.0):
+        """send raw command packet"""
+        packet = COMMAND_PACKET.pack(
+            COMMAND_MAGIC, cmd, self._seq & 0xffff, monotonic_clock(),
+            a, b, c)
+        self._seq += 1
+        self._socket.sendto(packet, self.server)
+
+    def subscribe(self):
+        """ask the server to send telemetry to this client"""
+        self.send_command(CMD_SUBSCRIBE)
+
+    def set_operate_mode(self, val):
+        self.send_command(CMD_OPERATE_MODE, val)
+
+    def set_visioncontrol_xy(self, tx, ty):
+        self.send_command(CMD_VISIONCONTROL_XY, tx, ty)
+
+    def set_rangecontrol_z(self, tz):
+        self.send_command(CMD_RANGECONTROL_Z, tz)
+
+    def set_dst_degx(self, val):
+        self.send_command(CMD_DST_DEGX, val)
+
+    def set_dst_degy(self, val):
+        self.send_command(CMD_DST_DEGY, val)
+
+    def set_dst_degz(self, val):
+        self.send_command(CMD_DST_DEGZ, val)
+
+    def set_led(self, led, state):
+        self.send_command(CMD_LED, led, int(bool(state)))
+
+    def set_buzzer(self, state):
+        self.send_command(CMD_BUZZER, int(bool(state)))
+
+    def receive(self, timeout=None):
+        """return list(Telemetry) of one packet, or [] on timeout"""
+        self._socket.settimeout(timeout)
+        while True:
+            try:
+                packet, _ = self._socket.recvfrom(65536)
+            except socket.timeout:
+                return []
+            result = unpack_telemetry(packet)
+            if result is None:
+                continue
+            seq, samples = result
+            if self.last_seq is not None:
+                self.lost_packets += (seq - self.last_seq - 1) & 0xffff
+            self.last_seq = seq
+            return samples
+
+
+def benchmark(rate=200.0, duration=3.0, batch=5):
+    """measure loopback latency and throughput with a simulated vehicle
+
+    return dict of the results.
+    """
+    from phenox_client import Phenox
+    from phenox_sim import SimBackend
+
+    backend = SimBackend(keepalive_timeout=None)
+    server = GroundLinkServer(
+        Phenox(backend), ("127.0.0.1", 0), rate=rate, batch=batch)
+    server.start()
+    client = GroundLinkClient(server.address, ("127.0.0.1", 0))
+    client.subscribe()
+
+    received = []
+    stop = threading.Event()
+
+    def receive_loop():
+        while not stop.is_set():
+            received.extend(client.receive(timeout=0.1))
+
+    receiver = threading.Thread(target=receive_loop)
+    receiver.start()
+
+    started = monotonic_clock()
+    next_tick = started
+    ticks = 0
+    while monotonic_clock() - started < duration:
+        #ground station sends one setpoint per tick
+        client.set_visioncontrol_xy(float(ticks % 100), 0.0)
+        #control tick
+        backend.step(1.0 / rate)
+        server.apply_commands()
+        server.record()
+        ticks += 1
+        next_tick += 1.0 / rate
+        delay = next_tick - monotonic_clock()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = monotonic_clock() - started
+    server.flush()
+    time.sleep(0.2)
+    stop.set()
+    receiver.join()
+    server.stop()
+    client.close()
+
+    applied = server.commands_applied
+    return {
+        "tick_rate": ticks / elapsed,
+        "telemetry_rate": len(received) / elapsed,
+        "packets_sent": server.packets_sent,
+        "lost_packets": client.lost_packets,
+        "commands_applied": applied,
+        "latency_mean": server.latency_sum / applied if applied else 0.0,
+        "latency_max": server.latency_max
+    }
+
+
+def main():
+    import sys
+
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 200.0
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    result = benchmark(rate, duration)
+    for key in sorted(result):
+        print("{0:>16}: {1:.4f}".format(key, result[key]))
+
+if __name__ == "__main__":
+    main()
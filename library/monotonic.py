@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""monotonic clock for timestamps and intervals.
+
+this module depends only on the standard library, so that ground
+station tools (e.g. 'flightlog.py' reader) do not need OpenCV.
+
+python 2 has no 'time.monotonic', and 'time.time' jumps when the system
+time is set (e.g. NTP sync after Wi-Fi comes up), which breaks deadlines
+and intervals. so 'clock_gettime(CLOCK_MONOTONIC)' is called through
+ctypes there.
+"""
+
+import ctypes
+import os
+import time
+
+#from <time.h> on Linux
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_long),
+        ("tv_nsec", ctypes.c_long)
+    ]
+
+
+def _libc_monotonic():
+    """return clock function using clock_gettime, or None if unavailable"""
+    #older glibc has clock_gettime in librt only
+    for name in (None, "librt.so.1"):
+        try:
+            clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+            break
+        except (OSError, AttributeError):
+            continue
+    else:
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    clock_gettime.restype = ctypes.c_int
+
+    def monotonic():
+        ts = _Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+
+monotonic_clock = getattr(time, "monotonic", None) or _libc_monotonic()
+
+#False if only the wall clock is available (it may jump)
+IS_MONOTONIC = monotonic_clock is not None
+if monotonic_clock is None:
+    monotonic_clock = time.time
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+"""incremental tiled floor mosaic from bottom camera frames.
+
+TiledMosaic places each PX_BOTTOM_CAM frame into a sparse map using
+'vision_tx/ty', 'height' and 'degz' of SelfState.
+the map consists of fixed-size tiles allocated when a frame first
+covers them. only recently used tiles are kept in memory, and cold tiles
+are evicted to a memory-mapped file (TileStore), so long flights do not
+grow the memory usage.
+
+downsampled tiles for zoom levels are kept in a bounded cache too.
+only the ones covering changed tiles are rebuilt, and evicted ones are
+rebuilt on demand, so the whole map is never re-rendered.
+
+usage:
+
+mosaic = TiledMosaic("/mnt/map/flight01")
+st = px.SelfState()
+while flying:
+    img = px.get_image(px.PX_BOTTOM_CAM, 'ndarray')
+    if img is None:
+        continue
+    px.get_selfstate(st)
+    mosaic.add_frame(img, st)
+view = mosaic.render(mosaic.bounds(), level=2)
+cv2.imwrite("map.png", view)
+mosaic.close()
+
+map coordinates are in centi-meter; level 0 has 'resolution' cm/px
+and each level halves the image size.
+"""
+
+import collections
+import json
+import math
+import os
+
+import numpy
+import cv2
+
+from phenox_client import PX_CAM_FOCAL_LENGTH
+
+
+class TileStore(object):
+    """memory-mapped file which keeps evicted tiles
+
+    path: data file path ('<path>.json' keeps the index)
+    tile_shape: shape of a tile (height, width, channels)
+    sync_interval: the data and the index are written to the disk
+        every this number of new tiles, so at most this number of
+        tiles are lost after a crash
+    """
+
+    def __init__(self, path, tile_shape, initial_slots=16, sync_interval=16):
+        self.path = path
+        self.tile_shape = tuple(tile_shape)
+        self.sync_interval = sync_interval
+        self._unsynced = 0
+        self._tile_bytes = int(numpy.prod(self.tile_shape))
+        self._index = {}
+        index_path = path + ".json"
+        if os.path.exists(path) and os.path.exists(index_path):
+            with open(index_path) as f:
+                saved = json.load(f)
+            if tuple(saved["tile_shape"]) != self.tile_shape:
+                raise ValueError("tile shape differs from the stored one")
+            self._index = dict(
+                (tuple(key), slot) for key, slot in saved["tiles"])
+            slots = os.path.getsize(path) // self._tile_bytes
+        else:
+            slots = initial_slots
+            with open(path, "wb") as f:
+                f.truncate(slots * self._tile_bytes)
+        self._open(slots)
+
+    def _open(self, slots):
+        self._slots = slots
+        self._data = numpy.memmap(
+            self.path, numpy.uint8, "r+",
+            shape=(slots,) + self.tile_shape)
+
+    def _grow(self):
+        self._data.flush()
+        del self._data
+        slots = self._slots * 2
+        with open(self.path, "r+b") as f:
+            f.truncate(slots * self._tile_bytes)
+        self._open(slots)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return list(self._index.keys())
+
+    def write(self, key, tile):
+        slot = self._index.get(key)
+        if slot is None:
+            slot = len(self._index)
+            if slot >= self._slots:
+                self._grow()
+            self._index[key] = slot
+            self._unsynced += 1
+        self._data[slot] = tile
+        if self._unsynced >= self.sync_interval:
+            self.flush()
+
+    def read(self, key, out=None):
+        """return copy of the tile, or None if not stored"""
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        if out is None:
+            return numpy.array(self._data[slot])
+        out[...] = self._data[slot]
+        return out
+
+    def flush(self):
+        #data first, so that the index never points to unwritten tiles
+        self._data.flush()
+        #write to temporary file and rename it
+        #so that the index is valid even if power is lost
+        index_path = self.path + ".json"
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({
+                "tile_shape": list(self.tile_shape),
+                "tiles": [[list(key), slot]
+                          for key, slot in self._index.items()]
+            }, f)
+        os.rename(index_path + ".tmp", index_path)
+        self._unsynced = 0
+
+    def close(self):
+        self.flush()
+        del self._data
+
+
+class TiledMosaic(object):
+    """sparse tiled map built incrementally from camera frames
+
+    directory: directory of the tile store
+    resolution: map resolution of level 0 [cm/px]
+    tile_size: edge length of a tile [px]
+    max_tiles: number of level 0 tiles kept in memory
+    max_level_tiles: number of zoom level tiles kept in memory
+        (None means same as max_tiles)
+    levels: number of zoom levels (level 0 included)
+    focal_length: focal length of the camera [px]
+    axis_sign: (sign x, sign y) from image axes to map axes;
+        depends on how the camera is mounted
+    """
+
+    def __init__(self, directory, resolution=0.5, tile_size=256,
+                 max_tiles=32, max_level_tiles=None, levels=4,
+                 focal_length=PX_CAM_FOCAL_LENGTH, axis_sign=(1.0, 1.0)):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.resolution = resolution
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.max_level_tiles = (max_tiles if max_level_tiles is None
+                                else max_level_tiles)
+        self.levels = levels
+        self.focal_length = focal_length
+        self.axis_sign = axis_sign
+        self._tile_shape = (tile_size, tile_size, 3)
+        self._store = TileStore(
+            os.path.join(directory, "tiles.dat"), self._tile_shape)
+        #level 0 tiles in memory (least recently used first)
+        self._tiles = collections.OrderedDict()
+        #downsampled tiles: (level, key) -> ndarray (least recently used first)
+        self._pyramid = collections.OrderedDict()
+        self._dirty = set(
+            (level, (i >> level, j >> level))
+            for i, j in self._store.keys()
+            for level in range(1, levels))
+        self.frames = 0
+        self.evictions = 0
+        self.level_evictions = 0
+
+    def _tile(self, key):
+        """return level 0 tile for writing (load or allocate on demand)"""
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            tile = self._store.read(key)
+            if tile is None:
+                tile = numpy.zeros(self._tile_shape, numpy.uint8)
+            while len(self._tiles) >= self.max_tiles:
+                self._evict()
+        self._tiles[key] = tile
+        return tile
+
+    def _evict(self):
+        key, tile = self._tiles.popitem(last=False)
+        self._store.write(key, tile)
+        self.evictions += 1
+
+    def _read_tile(self, key):
+        """return level 0 tile for reading, or None if never written"""
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self._store.read(key)
+        return tile
+
+    def frame_transform(self, frame_shape, state):
+        """return 2x3 affine matrix from frame pixel to level 0 map pixel"""
+        h, w = frame_shape[:2]
+        scale = state.height / self.focal_length / self.resolution
+        theta = math.radians(state.degz)
+        c, s = math.cos(theta) * scale, math.sin(theta) * scale
+        sx, sy = self.axis_sign
+        cx = state.vision_tx / self.resolution
+        cy = state.vision_ty / self.resolution
+        #rotate and scale around the frame center, then move to position
+        return numpy.array([
+            [sx * c, -sx * s, cx - sx * (c * w / 2.0 - s * h / 2.0)],
+            [sy * s, sy * c, cy - sy * (s * w / 2.0 + c * h / 2.0)]
+        ])
+
+    def add_frame(self, frame, state):
+        """paste frame into the map at the position of state
+
+        frame: BGR ndarray
+        state: SelfState at capture time ('height' must be positive)
+        """
+        if state.height <= 0:
+            return False
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        matrix = self.frame_transform(frame.shape, state)
+        h, w = frame.shape[:2]
+        corners = numpy.dot(
+            matrix[:, :2],
+            numpy.array([[0, w, w, 0], [0, 0, h, h]], numpy.float64)
+        ) + matrix[:, 2:]
+        size = self.tile_size
+        i0, j0 = numpy.floor(corners.min(axis=1) / size).astype(int)
+        i1, j1 = numpy.floor(corners.max(axis=1) / size).astype(int)
+
+        for j in range(j0, j1 + 1):
+            for i in range(i0, i1 + 1):
+                tile = self._tile((i, j))
+                shifted = matrix.copy()
+                shifted[0, 2] -= i * size
+                shifted[1, 2] -= j * size
+                #BORDER_TRANSPARENT keeps the pixels outside the frame
+                cv2.warpAffine(frame, shifted, (size, size), dst=tile,
+                               flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_TRANSPARENT)
+                for level in range(1, self.levels):
+                    self._dirty.add((level, (i >> level, j >> level)))
+        self.frames += 1
+        return True
+
+    def level_tile(self, level, key):
+        """return tile of the zoom level, or None if nothing is drawn
+
+        a level tile covers 2**level x 2**level level 0 tiles.
+        """
+        if level == 0:
+            return self._read_tile(key)
+        item = (level, key)
+        if item in self._dirty:
+            self._dirty.discard(item)
+            tile = self._build(level, key)
+            if tile is None:
+                return None
+        else:
+            tile = self._pyramid.get(item)
+            if tile is None:
+                return None
+        #pop first: assigning to an existing key keeps its LRU position
+        self._pyramid.pop(item, None)
+        self._pyramid[item] = tile
+        while len(self._pyramid) > self.max_level_tiles:
+            #rebuilt from the children when it is used again
+            evicted, _ = self._pyramid.popitem(last=False)
+            self._dirty.add(evicted)
+            self.level_evictions += 1
+        return tile
+
+    def _build(self, level, key):
+        size = self.tile_size
+        half = size // 2
+        i, j = key
+        result = None
+        for dj in range(2):
+            for di in range(2):
+                child = self.level_tile(level - 1, (2 * i + di, 2 * j + dj))
+                if child is None:
+                    continue
+                if result is None:
+                    result = numpy.zeros(self._tile_shape, numpy.uint8)
+                result[dj * half:(dj + 1) * half,
+                       di * half:(di + 1) * half] = cv2.resize(
+                    child, (half, half), interpolation=cv2.INTER_AREA)
+        return result
+
+    def bounds(self):
+        """return (x0, y0, x1, y1) [cm] covering all tiles, or None"""
+        keys = set(self._tiles.keys()) | set(self._store.keys())
+        if not keys:
+            return None
+        span = self.tile_size * self.resolution
+        ii = [k[0] for k in keys]
+        jj = [k[1] for k in keys]
+        return (min(ii) * span, min(jj) * span,
+                (max(ii) + 1) * span, (max(jj) + 1) * span)
+
+    def render(self, rect, level=0):
+        """return BGR image of rect (x0, y0, x1, y1) [cm] at zoom level
+
+        only the tiles of the level overlapping rect are used.
+        """
+        x0, y0, x1, y1 = rect
+        resolution = self.resolution * (1 << level)
+        px0, py0 = int(math.floor(x0 / resolution)), \
+            int(math.floor(y0 / resolution))
+        px1, py1 = int(math.ceil(x1 / resolution)), \
+            int(math.ceil(y1 / resolution))
+        image = numpy.zeros((py1 - py0, px1 - px0, 3), numpy.uint8)
+        size = self.tile_size
+        for j in range(py0 // size, (py1 - 1) // size + 1):
+            for i in range(px0 // size, (px1 - 1) // size + 1):
+                tile = self.level_tile(level, (i, j))
+                if tile is None:
+                    continue
+                #overlap of the tile and the image in level pixels
+                tx0, ty0 = max(i * size, px0), max(j * size, py0)
+                tx1, ty1 = min((i + 1) * size, px1), min((j + 1) * size, py1)
+                image[ty0 - py0:ty1 - py0, tx0 - px0:tx1 - px0] = \
+                    tile[ty0 - j * size:ty1 - j * size,
+                         tx0 - i * size:tx1 - i * size]
+        return image
+
+    def flush(self):
+        """write all tiles in memory to the store"""
+        for key, tile in self._tiles.items():
+            self._store.write(key, tile)
+        self._store.flush()
+
+    def close(self):
+        self.flush()
+        self._tiles.clear()
+        self._store.close()
+
+    def get_stats(self):
+        """return dict of tile statistics"""
+        stored = set(self._store.keys())
+        return {
+            "frames": self.frames,
+            "tiles": len(stored | set(self._tiles.keys())),
+            "tiles_in_memory": len(self._tiles),
+            "evictions": self.evictions,
+            "pyramid_tiles": len(self._pyramid),
+            "level_evictions": self.level_evictions
+        }
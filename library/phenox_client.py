@@ -0,0 +1,804 @@
+# -*- coding: utf-8 -*-
+
+"""instance based client to operate Phenox.
+
+'Phenox' class wraps a backend handle which provides the same functions
+as shared object library 'pxlib.so' (pxget_selfstate, pxset_operate_mode
+and so on). the backend is usually the ctypes library loaded by
+'phenox' module, but any object with the same functions can be used,
+e.g. simulated vehicles in 'phenox_sim' module.
+
+phenox = Phenox(ctypes.cdll.LoadLibrary(path))
+phenox.initialize()
+phenox.set_operate_mode(PX_UP)
+
+module 'phenox' keeps its module-level functions,
+which are bound methods of the default instance.
+
+in this module the unit is uniformed as follows unless explicitly declared:
+
+length: centi-meter
+angle: degree
+
+"""
+
+import struct
+import ctypes
+import threading
+
+import numpy
+
+#this module is used to transform IplImage* to python types
+import cv_c2py
+
+#re-exported: clock shared by the modules of this library
+from monotonic import monotonic_clock
+
+"""
+consts below are defined in C by this code.
+
+  typedef enum {
+    PX_HALT,
+    PX_UP,
+    PX_HOVER,
+    PX_DOWN
+  } px_flymode;
+
+  typedef enum {
+    PX_FRONT_CAM,
+    PX_BOTTOM_CAM
+  } px_cameraid;
+
+"""
+
+PX_HALT = 0
+PX_UP = 1
+PX_HOVER = 2
+PX_DOWN = 3
+
+PX_FRONT_CAM = 0
+PX_BOTTOM_CAM = 1
+
+PX_LED_RED = 0
+PX_LED_GREEN = 1
+
+#Camera data's shape in numpy.ndarray
+PX_CAM_DATA_SHAPE = (240, 320, 3)
+
+#rough focal length [px] of Phenox cameras in PX_CAM_DATA_SHAPE.
+#calibrate the camera for accurate measurement.
+PX_CAM_FOCAL_LENGTH = 280.0
+
+class PhenoxOperate(ctypes.Structure):
+    """ operation variable """
+
+    _fields_ = [
+        ("mode", ctypes.c_int),
+        ("vision_dtx", ctypes.c_float),
+        ("vision_dty", ctypes.c_float),
+        ("sonar_dtz", ctypes.c_float),
+        ("dangx", ctypes.c_float),
+        ("dangy", ctypes.c_float),
+        ("dangz", ctypes.c_float),
+        ("led", ctypes.c_int * 2),
+        ("buzzer", ctypes.c_int),
+        ("fix_selfposition_query", ctypes.c_int),
+        ("fix_selfposition_tx", ctypes.c_float),
+        ("fix_selfposition_ty", ctypes.c_float)
+    ]
+
+class PhenoxPrivate(ctypes.Structure):
+    """ operation variable """
+
+    _fields_ = [
+        ("ready", ctypes.c_int),
+        ("startup", ctypes.c_int),
+        ("selxy", ctypes.c_int),
+        ("dangz_rotbusy", ctypes.c_int),
+        ("keepalive", ctypes.c_int)
+    ]
+
+
+class PhenoxConfig(ctypes.Structure):
+    """ basic configuration parameters for Phenox """
+
+    _fields_ = [
+        ("duty_hover", ctypes.c_float),
+        ("duty_hover_max", ctypes.c_float),
+        ("duty_hover_min", ctypes.c_float),
+        ("duty_up", ctypes.c_float),
+        ("duty_down", ctypes.c_float),
+        ("duty_bias_front", ctypes.c_float),
+        ("duty_bias_back", ctypes.c_float),
+        ("duty_bias_left", ctypes.c_float),
+        ("duty_bias_right", ctypes.c_float),
+        ("pgain_vision_tx", ctypes.c_float),
+        ("pgain_vision_ty", ctypes.c_float),
+        ("dgain_vision_tx", ctypes.c_float),
+        ("dgain_vision_ty", ctypes.c_float),
+        ("pgain_sonar", ctypes.c_float),
+        ("dgain_sonar", ctypes.c_float),
+        ("whisleborder", ctypes.c_int),
+        ("soundborder", ctypes.c_int),
+        ("uptime_max", ctypes.c_float),
+        ("downtime_max", ctypes.c_float),
+        ("selxytime_max", ctypes.c_float),
+        ("dangz_rotspeed", ctypes.c_float),
+        ("featurecontrast_front", ctypes.c_int),
+        ("featurecontrast_bottom", ctypes.c_int),
+        ("pgain_degx", ctypes.c_float),
+        ("pgain_degy", ctypes.c_float),
+        ("pgain_degz", ctypes.c_float),
+        ("dgain_degx", ctypes.c_float),
+        ("dgain_degy", ctypes.c_float),
+        ("dgain_degz", ctypes.c_float),
+        ("pwm_or_servo", ctypes.c_int),
+        ("propeller_monitor", ctypes.c_int)
+    ]
+
+class SelfState(ctypes.Structure):
+    """ self state parameters of Phenox """
+
+    _fields_ = [
+        ("degx", ctypes.c_float),
+        ("degy", ctypes.c_float),
+        ("degz", ctypes.c_float),
+        ("vision_tx", ctypes.c_float),
+        ("vision_ty", ctypes.c_float),
+        ("vision_tz", ctypes.c_float),
+        ("vision_vx", ctypes.c_float),
+        ("vision_vy", ctypes.c_float),
+        ("vision_vz", ctypes.c_float),
+        ("height", ctypes.c_float),
+        ("battery", ctypes.c_int)
+    ]
+
+class ImageFeature(ctypes.Structure):
+    """ some special color point?? """
+
+    _fields_ = [
+        ("pcx", ctypes.c_float),
+        ("pcy", ctypes.c_float),
+        ("cx", ctypes.c_float),
+        ("cy", ctypes.c_float)
+    ]
+
+def _unknown_operate():
+    """return PhenoxOperate filled with 'not written yet' values"""
+    nan = float("nan")
+    return PhenoxOperate(
+        -1, nan, nan, nan, nan, nan, nan, (-1, -1), -1, 0, nan, nan
+        )
+
+class Phenox(object):
+    """client object operating one Phenox through a backend handle
+
+    lib: backend object which has pxlib functions
+    """
+
+    def __init__(self, lib):
+        self._lib = lib
+        #operate values written by this client (see 'get_operate')
+        self._operate = _unknown_operate()
+        #reentrant: OperateBatch.commit calls the setters holding it
+        self._operate_lock = threading.RLock()
+
+    @property
+    def lib(self):
+        """backend handle of this client"""
+        return self._lib
+
+    def initialize(self):
+        """allocate shared memory space and wait until CPU1 gets ready"""
+        self.init_chain()
+        while not self.get_cpu1ready():
+            pass
+
+    #1. Basic Functions
+    def init_chain(self):
+        """[DO NOT USE in user code] allocate shared memory space"""
+        self._lib.pxinit_chain()
+
+    def close_chain(self):
+        """[DO NOT USE in user code]release shared memory space"""
+        self._lib.pxclose_chain()
+
+    def get_cpu1ready(self):
+        """[DO NOT USE in user code]
+
+        return bool value indicating whether the CPU1 is ready
+        """
+        return bool(self._lib.pxget_cpu1ready())
+
+    def get_motorstatus(self):
+        """return bool value indicating whether motor is rotating"""
+        return bool(self._lib.pxget_motorstatus())
+
+    def set_pconfig(self, param):
+        """set PhenoxConfig defined by user
+
+        the argument must be 'PhenoxConfig' type, and
+        each property values have to be modified carefully for the safety
+        """
+        if isinstance(param, PhenoxConfig):
+            self._lib.pxset_pconfig(ctypes.byref(param))
+        else:
+            raise ValueError("pxset_pconfig only accepts 'PhenoxConfig'")
+
+    def get_pconfig(self, param=None):
+        """get current PhenoxConfig setting
+
+        if argument type is 'PhenoxConfig',
+        the attributes of the argument is overwritten by
+        current parameters.
+
+        in other cases, this function returns new 'PhenoxConfig' instance
+        with current parameters.
+
+        NOTE: using PhenoxConfig argument fasten the code.
+        """
+        if isinstance(param, PhenoxConfig):
+            self._lib.pxget_pconfig(ctypes.byref(param))
+        else:
+            result = PhenoxConfig()
+            self._lib.pxget_pconfig(ctypes.byref(result))
+            return result
+
+    def get_selfstate(self, state=None):
+        """ get current self attitude and position value.
+
+        if the argument type is 'SelfState',
+        the attributes of the argument will be overwritten
+        by current parameters and this function return None
+
+        else, this function returns new "SelfState" instance
+        with current state parameters.
+
+        NOTE: using SelfState arguments fasten the code
+        """
+
+        if isinstance(state, SelfState):
+            self._lib.pxget_selfstate(ctypes.byref(state))
+        else:
+            result = SelfState()
+            self._lib.pxget_selfstate(ctypes.byref(result))
+            return result
+
+    def set_keepalive(self):
+        """ publish the signal which indicates user code is running
+
+        in user program, this function has to be called periodically
+        """
+        self._lib.pxset_keepalive()
+
+
+    #2. Auto control functions
+    def set_operate_mode(self, val):
+        """set current operate mode
+
+        argument must be in [PX_HALT, PX_UP, PX_HOVER, PX_DOWN]
+        for the detail, please see Phenox wiki(for C lang)
+        """
+        if val in [PX_HALT, PX_UP, PX_HOVER, PX_DOWN]:
+            with self._operate_lock:
+                self._lib.pxset_operate_mode(val)
+        else:
+            raise ValueError("pxset_operate_mode only accepts 'int'")
+
+    def get_operate_mode(self):
+        """get int value that indicates operate mode
+
+        result means:
+            0(PX_HALT): stop all motors
+            1(PX_UP): starting and going up to hover
+            2(PX_HOVER): hovering or cruising
+            3(PX_DOWN): executing landing maneuver
+        """
+        return self._lib.pxget_operate_mode()
+
+    def operate(self):
+        """return new OperateBatch to change setpoints at once
+
+        with phenox.operate() as op:
+            op.set_visioncontrol_xy(tx, ty)
+            op.set_rangecontrol_z(tz)
+
+        changes are written when the block exits without exception.
+        """
+        return OperateBatch(self)
+
+    def get_operate(self, operate=None):
+        """get operate variables as 'PhenoxOperate'
+
+        'mode' is the current operate mode, and the other fields are
+        the values last written by this client
+        (NaN or -1 for fields never written).
+
+        if the argument type is 'PhenoxOperate', its attributes are
+        overwritten and this function returns None,
+        else this function returns new 'PhenoxOperate' instance.
+        """
+        result = operate if isinstance(operate, PhenoxOperate) \
+            else PhenoxOperate()
+        with self._operate_lock:
+            ctypes.pointer(result)[0] = self._operate
+        result.mode = self.get_operate_mode()
+        if result is not operate:
+            return result
+
+    def get_private(self, private=None):
+        """get status variables as 'PhenoxPrivate'
+
+        pxlib exposes only 'ready' (whether the CPU1 is ready).
+        the other fields are unknown and set to -1.
+
+        argument and return value are same as 'get_operate'.
+        """
+        result = private if isinstance(private, PhenoxPrivate) \
+            else PhenoxPrivate()
+        result.ready = int(self.get_cpu1ready())
+        result.startup = -1
+        result.selxy = -1
+        result.dangz_rotbusy = -1
+        result.keepalive = -1
+        if result is not private:
+            return result
+
+    def set_visioncontrol_xy(self, tx, ty):
+        """set vision control target horizontal positions(tx, ty)
+
+        tx and ty must be float value.
+        """
+        if ((isinstance(tx, float) or isinstance(tx, int)) and
+            (isinstance(ty, float) or isinstance(ty, int))
+            ):
+            with self._operate_lock:
+                self._lib.pxset_visioncontrol_xy(ctypes.c_float(tx), ctypes.c_float(ty))
+                self._operate.vision_dtx = tx
+                self._operate.vision_dty = ty
+        else:
+            raise ValueError("pxset_visioncontrol_xy only accepts 'float', 'float'")
+
+    def set_rangecontrol_z(self, tz):
+        """set range control target height by choosing tz
+
+        tz must be float value.
+        """
+        if isinstance(tz, float) or isinstance(tz, int):
+            with self._operate_lock:
+                self._lib.pxset_rangecontrol_z(ctypes.c_float(tz))
+                self._operate.sonar_dtz = tz
+        else:
+            raise ValueError("pxset_rangecontrol_z only accepts 'float'")
+
+    def set_dst_degx(self, val):
+        """set destination pitch angle
+
+        angle must be float value
+        """
+        if isinstance(val, float) or isinstance(val, int):
+            with self._operate_lock:
+                self._lib.pxset_dst_degx(ctypes.c_float(val))
+                self._operate.dangx = val
+        else:
+            raise ValueError("pxset_dst_pitch only accepts 'float'")
+
+    def set_dst_degy(self, val):
+        """set destination roll angle
+
+        angle must be float value
+        """
+        if isinstance(val, float) or isinstance(val, int):
+            with self._operate_lock:
+                self._lib.pxset_dst_degy(ctypes.c_float(val))
+                self._operate.dangy = val
+        else:
+            raise ValueError("pxset_dst_roll only accepts 'float'")
+
+    def set_dst_degz(self, val):
+        """set destination yaw angle
+
+        angle must be float value
+        """
+        if isinstance(val, float) or isinstance(val, int):
+            with self._operate_lock:
+                self._lib.pxset_dst_degz(ctypes.c_float(val))
+                self._operate.dangz = val
+        else:
+            raise ValueError("pxset_dst_yaw only accepts 'float'")
+
+    def set_visualselfposition(self, tx, ty):
+        """ set selfposition value to adjust or reset coordinate
+
+        tx and ty must be float value
+        """
+        if isinstance(tx, float) and isinstance(ty, float):
+            with self._operate_lock:
+                result = self._lib.pxset_visualselfposition(
+                    ctypes.c_float(tx),
+                    ctypes.c_float(ty)
+                    )
+                self._operate.fix_selfposition_query = 1
+                self._operate.fix_selfposition_tx = tx
+                self._operate.fix_selfposition_ty = ty
+            return result
+        else:
+            raise ValueError(
+                "pxset_visualselfposition only accepts 'float, float, float'"
+                )
+
+    #3. Image processing
+    #3-a. raw image
+    def get_image(self, cameraId, restype='iplimage', image=None):
+        """try to get image data obtained by camera.
+
+        if use this function, 'set_img_seq' function has to be called periodically.
+
+        argument means:
+            cameraId: phenox.PX_FRONT_CAM or phenox.PX_BOTTOM_CAM
+            restype: result images's type from 2 choices below
+                'iplimage' -> cv2.cv.iplimage
+                'ndarray'  -> numpy.ndarray
+                NOTE: invalid option is treated same as 'iplimage'
+
+        return:
+            if succeed to get image -> image data(iplimage or ndarray)
+            if failed to get image  -> None
+
+        if image is numpy.ndarray with shape PX_CAM_DATA_SHAPE and
+        dtype uint8, image data is copied into it (restype is ignored) and
+        this function returns True if succeed, else False.
+
+        NOTE: using ndarray argument (e.g. from 'bufferpool') avoids
+        allocating a new image for each frame.
+        """
+        if not (cameraId == PX_FRONT_CAM or cameraId == PX_BOTTOM_CAM):
+            raise ValueError("cameraId must be PX_FRONT_CAM or PX_BOTTOM_CAM")
+
+        img_ptr = ctypes.POINTER(cv_c2py.IplImage)()
+        result = self._lib.pxget_imgfullwcheck(cameraId, ctypes.byref(img_ptr))
+
+        if isinstance(image, numpy.ndarray):
+            if result != 1:
+                return False
+            cv_c2py.ipl2array_into(img_ptr, image)
+            return True
+
+        if result != 1:
+            return None
+
+        if restype == 'ndarray':
+            return cv_c2py.ipl2array(img_ptr, PX_CAM_DATA_SHAPE)
+        else:
+            return cv_c2py.ipl2iplimage(img_ptr, PX_CAM_DATA_SHAPE)
+
+
+    def set_img_seq(self, cameraId):
+        """send command to write a part of image
+
+        when use 'get_image' this function has to be called periodically.
+        """
+        if not (cameraId == PX_FRONT_CAM or cameraId == PX_BOTTOM_CAM):
+            raise ValueError(
+                "cameraId must be PX_FRONT_CAM or PX_BOTTOM_CAM"
+                )
+
+        self._lib.pxset_img_seq(cameraId);
+
+    #3-b. image feature points
+    def set_imgfeature_query(self, cameraId):
+        if not (cameraId == PX_FRONT_CAM or cameraId == PX_BOTTOM_CAM):
+            raise ValueError(
+                "cameraId must be PX_FRONT_CAM or PX_BOTTOM_CAM"
+                )
+
+        result = self._lib.pxset_imgfeature_query(cameraId);
+        if result == 1:
+            return True
+        else:
+            return False
+
+    def get_imgfeature(self, maxnum, feature=None):
+        """set image feature.
+
+        maxnum : int
+        feature : None or ImageFeature instance.
+
+        if feature is (ImageFeature * maxnum) array, then
+            feature is overwritten and return the number of detected feature point.
+            the case failed to obtain feature (because of busy) return -1
+
+        else, return value is:
+            if succeed  : list(ImageFeature)
+            else        : None
+        in success case, length of the list is trimmed to valid data length, so
+        the number of detected feature points is equal to len(result)
+        """
+        if not isinstance(maxnum, int):
+            raise ValueError("set_imgfeature only accepts 'int[, px_imgfeature]')")
+
+        if isinstance(feature, ImageFeature * maxnum):
+            return self._lib.pxget_imgfeature(feature, maxnum)
+        else:
+            ft = (ImageFeature * maxnum)()
+            res = self._lib.pxget_imgfeature(ft, maxnum)
+            if res == -1:
+                return None
+            else:
+                return list(ft)[:res]
+
+    #3-c. image color blob
+    def set_blobmark_query(self, cameraId, min_y, max_y, min_u, max_u, min_v, max_v):
+        """set blob mark query."""
+        if (isinstance(cameraId, int) and
+            isinstance(min_y, float) and
+            isinstance(max_y, float) and
+            isinstance(min_u, float) and
+            isinstance(max_u, float) and
+            isinstance(min_v, float) and
+            isinstance(max_v, float)
+            ):
+            res = self._lib.pxset_blobmark(
+                cameraId,
+                ctypes.c_float(min_y),
+                ctypes.c_float(max_y),
+                ctypes.c_float(min_u),
+                ctypes.c_float(max_u),
+                ctypes.c_float(min_v),
+                ctypes.c_float(max_v)
+            )
+            if res == 1:
+                return True
+            else:
+                return False
+        else:
+            raise TypeError("set_blobmark_query received incorrect type arguments.")
+
+    def get_blobmark(self):
+        """get blob mark"""
+        x, y, size = ctypes.c_float(), ctypes.c_float(), ctypes.c_float()
+        result = self._lib.pxget_blobmark(
+            ctypes.byref(x),
+            ctypes.byref(y),
+            ctypes.byref(size)
+            )
+        if result == 1:
+            return (True, x.value, y.value, size.value)
+        else:
+            return (False, x.value, y.value, size.value)
+
+    #4. sound processing
+    def get_whistle_is_detected(self):
+        """return True if whistle sound is detected, else return False"""
+        return bool(self._lib.pxget_whisle_detect())
+
+    def reset_whistle_is_detected(self):
+        """reset whistle detected flag to 0"""
+        self._lib.pxset_whisle_detect_reset()
+
+    def get_sound_recordstate(self):
+        """get sound record state."""
+        return self._lib.pxget_sound_recordstate()
+
+    def set_sound_recordquery(self, recordtime):
+        """set sound record query.
+
+        record time is in the range of (0, 50.0]
+        """
+        if isinstance(recordtime, float):
+            return self._lib.pxset_sound_recordquery(ctypes.c_float(recordtime))
+        else:
+            raise ValueError("set_sound_recordquery only accepts 'float'")
+
+    def get_sound(self, recordtime, restype='str', sound=None):
+        """get raw sound file.
+
+        recordtime should be expressed with second.
+        restype must be 'str' or 'list'.
+
+        returns:
+            if succeed to get sound data:
+                if restype == 'list' -> raw sound value list
+                if restype == 'str' -> binary str filled with raw sound data
+            if failed to get sound data (by busy or other reasons):
+                if restype == 'list' -> empty list(= [])
+                if restype == 'str' -> empty str("")
+
+        if sound is (ctypes.c_short * int(recordtime * 10000)) array,
+        sound is overwritten by raw sound data (restype is ignored) and
+        this function returns True if succeed, else False.
+        """
+        if isinstance(recordtime, float):
+            size = int(recordtime * 10000)
+            if isinstance(sound, ctypes.c_short * size):
+                result = self._lib.pxget_sound(sound, ctypes.c_float(recordtime))
+                return result == 1
+            buffer = (ctypes.c_short * size)()
+            result = self._lib.pxget_sound(buffer, ctypes.c_float(recordtime))
+            if result == 1:
+                if restype == 'list':
+                    return list(buffer)
+                else:
+                    return "".join(struct.pack('h', v) for v in buffer)
+            else:
+                if restype == 'list':
+                    return []
+                else:
+                    return ""
+        else:
+            raise ValueError("get_sound only accepts 'float'")
+
+
+
+    #5. logger and indicator
+    def set_led(self, led, state):
+        """set led state.
+
+        led: select LED (phenox.PX_LED_RED or phenox.PX_LED_GREEN)
+        state:
+            True -> LED ON
+            False -> LED OFF
+        """
+        if not (led == PX_LED_RED or led == PX_LED_GREEN):
+            raise ValueError("led must be PX_LED_RED or PX_LED_GREEN")
+
+        with self._operate_lock:
+            self._lib.pxset_led(led, int(bool(state)))
+            self._operate.led[led] = int(bool(state))
+
+    def set_buzzer(self, state):
+        """set buzzer state
+
+        Phenox buzzer has only 2 states(ON of OFF).
+        if bool(state) == True, buzzer turns on, else turns off.
+        """
+        with self._operate_lock:
+            self._lib.pxset_buzzer(int(bool(state)))
+            self._operate.buzzer = int(bool(state))
+
+
+    def set_systemlog(self):
+        """set systemlog."""
+        self._lib.pxset_systemlog()
+
+    def get_battery_is_low(self):
+        """return whether battery voltage is low"""
+        return bool(self._lib.pxget_battery())
+
+
+class OperateBatch(object):
+    """collect setpoint changes and write them in one commit
+
+    usually created by 'Phenox.operate'.
+    each setter has the same arguments as the one of 'Phenox', and
+    the last value for each field is kept until 'commit'.
+
+    'commit' writes only the fields which differ from the values
+    last written by the client, so calling the same setters every
+    tick costs no FFI call for unchanged setpoints.
+    operate mode and visual self position are written whenever set,
+    because Phenox changes them by itself.
+
+    the commit is not atomic for the flight controller: pxlib has no
+    block write, so each changed field is a separate FFI call and the
+    controller may run with a half-applied combination in between.
+    the lock only keeps other Python threads from interleaving.
+    """
+
+    #write order of the fields
+    _ORDER = (
+        "vision_xy", "sonar_dtz", "dangx", "dangy", "dangz",
+        "led0", "led1", "buzzer", "selfposition", "mode"
+        )
+
+    def __init__(self, phenox):
+        self._phenox = phenox
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def _float(self, name, *values):
+        for v in values:
+            if not (isinstance(v, float) or isinstance(v, int)):
+                raise ValueError("{0} only accepts 'float'".format(name))
+        return tuple(float(v) for v in values)
+
+    def set_operate_mode(self, val):
+        if val not in [PX_HALT, PX_UP, PX_HOVER, PX_DOWN]:
+            raise ValueError("set_operate_mode only accepts 'int'")
+        self._pending["mode"] = val
+
+    def set_visioncontrol_xy(self, tx, ty):
+        self._pending["vision_xy"] = self._float(
+            "set_visioncontrol_xy", tx, ty)
+
+    def set_rangecontrol_z(self, tz):
+        self._pending["sonar_dtz"] = self._float("set_rangecontrol_z", tz)
+
+    def set_dst_degx(self, val):
+        self._pending["dangx"] = self._float("set_dst_degx", val)
+
+    def set_dst_degy(self, val):
+        self._pending["dangy"] = self._float("set_dst_degy", val)
+
+    def set_dst_degz(self, val):
+        self._pending["dangz"] = self._float("set_dst_degz", val)
+
+    def set_led(self, led, state):
+        if not (led == PX_LED_RED or led == PX_LED_GREEN):
+            raise ValueError("led must be PX_LED_RED or PX_LED_GREEN")
+        self._pending["led{0}".format(led)] = (int(bool(state)),)
+
+    def set_buzzer(self, state):
+        self._pending["buzzer"] = (int(bool(state)),)
+
+    def set_visualselfposition(self, tx, ty):
+        if not (isinstance(tx, float) and isinstance(ty, float)):
+            raise ValueError(
+                "set_visualselfposition only accepts 'float, float'"
+                )
+        self._pending["selfposition"] = (tx, ty)
+
+    def is_empty(self):
+        """return True if no change is pending"""
+        return not self._pending
+
+    def discard(self):
+        """drop pending changes"""
+        self._pending = {}
+
+    def commit(self):
+        """write changed fields and return the number of FFI writes"""
+        phenox = self._phenox
+        written = 0
+        with phenox._operate_lock:
+            current = phenox._operate
+            for key in self._ORDER:
+                if key not in self._pending:
+                    continue
+                value = self._pending[key]
+                if key == "mode":
+                    phenox.set_operate_mode(value)
+                elif key == "selfposition":
+                    phenox.set_visualselfposition(*value)
+                elif key == "vision_xy":
+                    if _changed(current.vision_dtx, value[0]) or \
+                       _changed(current.vision_dty, value[1]):
+                        phenox.set_visioncontrol_xy(*value)
+                    else:
+                        continue
+                elif key == "sonar_dtz":
+                    if not _changed(current.sonar_dtz, value[0]):
+                        continue
+                    phenox.set_rangecontrol_z(*value)
+                elif key in ("dangx", "dangy", "dangz"):
+                    if not _changed(getattr(current, key), value[0]):
+                        continue
+                    getattr(phenox, "set_dst_deg" + key[-1])(*value)
+                elif key in ("led0", "led1"):
+                    led = int(key[-1])
+                    if current.led[led] == value[0]:
+                        continue
+                    phenox.set_led(led, value[0])
+                elif key == "buzzer":
+                    if current.buzzer == value[0]:
+                        continue
+                    phenox.set_buzzer(value[0])
+                written += 1
+        self._pending = {}
+        return written
+
+
+def _changed(stored, value):
+    """compare c_float field value with python float
+
+    value is rounded to c_float before comparison.
+    """
+    return stored != ctypes.c_float(value).value
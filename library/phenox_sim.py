@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""simulated backend for 'phenox_client.Phenox'.
+
+SimBackend provides the same functions as 'pxlib.so' with a simple
+kinematic model, so control logic can be tested without hardware.
+
+backend = SimBackend()
+phenox = Phenox(backend)
+phenox.initialize()
+phenox.set_rangecontrol_z(150.0)
+phenox.set_operate_mode(PX_UP)
+while True:
+    backend.step(0.01)
+    ...
+
+camera, sound and blob functions report 'no data' (busy).
+"""
+
+import ctypes
+import random
+
+from phenox_client import PX_HALT, PX_UP, PX_HOVER, PX_DOWN, PhenoxConfig
+
+
+def _value(arg):
+    """return python value of ctypes simple type or python value"""
+    return getattr(arg, "value", arg)
+
+
+def _deref(arg):
+    """return ctypes object referred by ctypes.byref() or pointer"""
+    obj = getattr(arg, "_obj", None)
+    if obj is not None:
+        return obj
+    return getattr(arg, "contents", arg)
+
+
+def _approach(current, target, max_delta):
+    """move current toward target by at most max_delta"""
+    diff = target - current
+    if diff > max_delta:
+        return current + max_delta
+    elif diff < -max_delta:
+        return current - max_delta
+    else:
+        return target
+
+
+class SimBackend(object):
+    """kinematic simulation of one Phenox with pxlib compatible functions
+
+    climb_rate: vertical speed in UP/DOWN mode [cm/s]
+    max_speed: horizontal speed limit [cm/s]
+    position_gain: horizontal P gain toward vision control target [1/s]
+    keepalive_timeout: start landing when keepalive is not received
+        for this period while flying [s] (None disables)
+    noise: standard deviation of attitude noise [deg]
+    seed: random seed for noise
+    """
+
+    def __init__(self, climb_rate=60.0, max_speed=50.0, position_gain=1.5,
+                 keepalive_timeout=1.0, noise=0.0, seed=None):
+        self.climb_rate = climb_rate
+        self.max_speed = max_speed
+        self.position_gain = position_gain
+        self.keepalive_timeout = keepalive_timeout
+        self.noise = noise
+        self._random = random.Random(seed)
+
+        self.time = 0.0
+        self.mode = PX_HALT
+        self.pconfig = PhenoxConfig()
+        self.led = [0, 0]
+        self.buzzer = 0
+        self.battery_low = False
+
+        self.tx = self.ty = 0.0
+        self.vx = self.vy = self.vz = 0.0
+        self.height = 0.0
+        self.degx = self.degy = self.degz = 0.0
+
+        self.dst_tx = self.dst_ty = 0.0
+        self.dst_tz = 100.0
+        self.dst_degx = self.dst_degy = self.dst_degz = 0.0
+        self._last_keepalive = 0.0
+
+    def step(self, dt):
+        """advance simulation time by dt second"""
+        self.time += dt
+        if (self.keepalive_timeout is not None and
+            self.mode in (PX_UP, PX_HOVER) and
+            self.time - self._last_keepalive > self.keepalive_timeout):
+            self.mode = PX_DOWN
+
+        prev_height = self.height
+        if self.mode == PX_UP:
+            self.height = _approach(
+                self.height, self.dst_tz, self.climb_rate * dt)
+            if self.height == self.dst_tz:
+                self.mode = PX_HOVER
+        elif self.mode == PX_HOVER:
+            self.height = _approach(
+                self.height, self.dst_tz, self.climb_rate * dt)
+        elif self.mode == PX_DOWN:
+            self.height = max(0.0, self.height - self.climb_rate * dt)
+            if self.height == 0.0:
+                self.mode = PX_HALT
+        self.vz = (self.height - prev_height) / dt if dt > 0 else 0.0
+
+        if self.mode == PX_HOVER:
+            vx = self.position_gain * (self.dst_tx - self.tx)
+            vy = self.position_gain * (self.dst_ty - self.ty)
+            self.vx = max(-self.max_speed, min(self.max_speed, vx))
+            self.vy = max(-self.max_speed, min(self.max_speed, vy))
+        else:
+            self.vx = self.vy = 0.0
+        self.tx += self.vx * dt
+        self.ty += self.vy * dt
+
+        if self.mode == PX_HALT:
+            self.degx = self.degy = 0.0
+        else:
+            self.degx = self.dst_degx + self._random.gauss(0.0, self.noise)
+            self.degy = self.dst_degy + self._random.gauss(0.0, self.noise)
+            self.degz = self.dst_degz
+
+    #pxlib compatible functions
+    def pxinit_chain(self):
+        pass
+
+    def pxclose_chain(self):
+        pass
+
+    def pxget_cpu1ready(self):
+        return 1
+
+    def pxget_motorstatus(self):
+        return int(self.mode != PX_HALT)
+
+    def pxset_pconfig(self, param):
+        ctypes.pointer(self.pconfig)[0] = _deref(param)
+
+    def pxget_pconfig(self, param):
+        ctypes.pointer(_deref(param))[0] = self.pconfig
+
+    def pxget_selfstate(self, state):
+        st = _deref(state)
+        st.degx, st.degy, st.degz = self.degx, self.degy, self.degz
+        st.vision_tx, st.vision_ty, st.vision_tz = (
+            self.tx, self.ty, self.height)
+        st.vision_vx, st.vision_vy, st.vision_vz = self.vx, self.vy, self.vz
+        st.height = self.height
+        st.battery = int(self.battery_low)
+
+    def pxset_keepalive(self):
+        self._last_keepalive = self.time
+
+    def pxset_operate_mode(self, val):
+        val = _value(val)
+        if val == PX_UP and self.mode == PX_HALT:
+            self._last_keepalive = self.time
+        self.mode = val
+
+    def pxget_operate_mode(self):
+        return self.mode
+
+    def pxset_visioncontrol_xy(self, tx, ty):
+        self.dst_tx, self.dst_ty = _value(tx), _value(ty)
+
+    def pxset_rangecontrol_z(self, tz):
+        self.dst_tz = _value(tz)
+
+    def pxset_dst_degx(self, val):
+        self.dst_degx = _value(val)
+
+    def pxset_dst_degy(self, val):
+        self.dst_degy = _value(val)
+
+    def pxset_dst_degz(self, val):
+        self.dst_degz = _value(val)
+
+    def pxset_visualselfposition(self, tx, ty):
+        self.tx, self.ty = _value(tx), _value(ty)
+        return 1
+
+    def pxget_imgfullwcheck(self, cameraId, img_ptr):
+        return 0
+
+    def pxset_img_seq(self, cameraId):
+        pass
+
+    def pxset_imgfeature_query(self, cameraId):
+        return 1
+
+    def pxget_imgfeature(self, feature, maxnum):
+        return 0
+
+    def pxset_blobmark(self, cameraId, *ranges):
+        return 0
+
+    def pxget_blobmark(self, x, y, size):
+        return 0
+
+    def pxget_whisle_detect(self):
+        return 0
+
+    def pxset_whisle_detect_reset(self):
+        pass
+
+    def pxget_sound_recordstate(self):
+        return 0
+
+    def pxset_sound_recordquery(self, recordtime):
+        return 0
+
+    def pxget_sound(self, buffer, recordtime):
+        return 0
+
+    def pxset_led(self, led, state):
+        self.led[led] = state
+
+    def pxset_buzzer(self, state):
+        self.buzzer = state
+
+    def pxset_systemlog(self):
+        pass
+
+    def pxget_battery(self):
+        return int(self.battery_low)
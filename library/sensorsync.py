@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""timestamp-aligned sensor bundles.
+
+'get_image' and 'get_selfstate' are called at unrelated moments,
+so projecting image features with 'degx/degy/height' of the latest state
+uses a wrong attitude during fast motion.
+
+SensorSynchronizer timestamps every state sample and frame on a
+monotonic clock, keeps a short history of states and returns
+SensorBundle whose state is interpolated to the capture time of the frame.
+
+usage:
+
+sync = SensorSynchronizer(px.default_phenox)
+
+#in the control tick (e.g. timer thread of 'autohover.py')
+sync.sample_state()
+
+#instead of px.set_img_seq in the image sequence thread
+sync.request_image()
+
+#in the vision loop
+bundle = sync.capture()
+if bundle is not None:
+    process(bundle.frame, bundle.state)
+"""
+
+import threading
+
+import numpy
+
+from phenox_client import PX_BOTTOM_CAM, SelfState, monotonic_clock
+
+#fields of SelfState interpolated by StateHistory
+STATE_FIELDS = [name for name, _ in SelfState._fields_]
+
+#yaw angle wraps around at +-180 degree
+_ANGLE_FIELDS = ("degz",)
+
+
+class StateHistory(object):
+    """ring buffer of timestamped SelfState values
+
+    capacity: number of samples kept
+    """
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self._t = numpy.zeros(capacity, numpy.float64)
+        self._values = numpy.zeros((capacity, len(STATE_FIELDS)),
+                                   numpy.float64)
+        self._head = 0
+        self._count = 0
+        self._angle_mask = numpy.array(
+            [name in _ANGLE_FIELDS for name in STATE_FIELDS])
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def push(self, state, t):
+        """append SelfState sampled at t; t must not decrease"""
+        i = self._head
+        self._t[i] = t
+        row = self._values[i]
+        for j, name in enumerate(STATE_FIELDS):
+            row[j] = getattr(state, name)
+        self._head = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def time_range(self):
+        """return (oldest t, newest t), or None if empty"""
+        if self._count == 0:
+            return None
+        newest = (self._head - 1) % self.capacity
+        oldest = (self._head - self._count) % self.capacity
+        return (self._t[oldest], self._t[newest])
+
+    def _ordered(self):
+        """return (t, values) in time order"""
+        if self._count < self.capacity:
+            return self._t[:self._count], self._values[:self._count]
+        order = numpy.roll(numpy.arange(self.capacity), -self._head)
+        return self._t[order], self._values[order]
+
+    def interpolate(self, t):
+        """return interpolated field values at t
+
+        t: float or 1D array of time
+        return: ndarray (len(STATE_FIELDS),) or (len(t), len(STATE_FIELDS))
+        times out of the history range are clamped to the oldest/newest.
+        """
+        if self._count == 0:
+            raise ValueError("state history is empty")
+        times, values = self._ordered()
+        query = numpy.atleast_1d(numpy.asarray(t, numpy.float64))
+        if self._count == 1:
+            result = numpy.repeat(values[:1], len(query), axis=0)
+        else:
+            query = numpy.clip(query, times[0], times[-1])
+            hi = numpy.clip(
+                numpy.searchsorted(times, query, side="right"),
+                1, self._count - 1)
+            lo = hi - 1
+            span = times[hi] - times[lo]
+            span[span <= 0] = 1.0
+            w = ((query - times[lo]) / span)[:, numpy.newaxis]
+            delta = values[hi] - values[lo]
+            #shortest way around for angles
+            delta[:, self._angle_mask] = (
+                (delta[:, self._angle_mask] + 180.0) % 360.0 - 180.0)
+            result = values[lo] + delta * w
+            wrapped = result[:, self._angle_mask]
+            result[:, self._angle_mask] = (wrapped + 180.0) % 360.0 - 180.0
+        if numpy.ndim(t) == 0:
+            return result[0]
+        return result
+
+    def state_at(self, t, state=None):
+        """return SelfState interpolated at t
+
+        if state is SelfState, it is overwritten and returned.
+        """
+        if not isinstance(state, SelfState):
+            state = SelfState()
+        values = self.interpolate(t)
+        for name, v in zip(STATE_FIELDS, values):
+            if name == "battery":
+                #not interpolated: use the nearest sample
+                v = round(v)
+            setattr(state, name, v)
+        return state
+
+
+class SensorBundle(object):
+    """one consistent snapshot of a vision cycle
+
+    t: capture time of the frame (monotonic clock)
+    frame: image obtained by 'get_image'
+    state: SelfState interpolated to t
+    features: list(ImageFeature) or None
+    features_t: time the feature query was issued, or None
+    features_state: SelfState interpolated to features_t, or None
+    extrapolated: True if t or features_t was outside the state history
+        (the oldest/newest sample is used)
+    """
+
+    def __init__(self, t, frame, state, features=None, features_t=None,
+                 features_state=None, extrapolated=False):
+        self.t = t
+        self.frame = frame
+        self.state = state
+        self.features = features
+        self.features_t = features_t
+        self.features_state = features_state
+        self.extrapolated = extrapolated
+
+
+class SensorSynchronizer(object):
+    """pair camera frames with states interpolated to their capture time
+
+    the capture time of a frame is the time of the 'request_image' call
+    which started the sequence, i.e. the first one after the previous
+    frame was obtained ('request_image' is usually called periodically,
+    so the later calls are about "now"). if 'request_image' is not used
+    (e.g. 'set_img_seq' is called elsewhere), a measured frame_latency
+    is required, and the capture time is the time 'get_image' returned
+    minus frame_latency.
+
+    features are stamped with the time of 'request_features' which
+    issued the query, because they are computed from the image of
+    that moment, not from the frame returned with them.
+
+    phenox: phenox_client.Phenox instance (or 'phenox' module)
+    camera: PX_FRONT_CAM or PX_BOTTOM_CAM
+    history: number of state samples kept
+    frame_latency: delay between exposure and 'get_image' return [s]
+    maxnum: maximum number of features obtained with each frame
+        (0 disables 'get_imgfeature')
+    """
+
+    def __init__(self, phenox, camera=PX_BOTTOM_CAM, history=128,
+                 frame_latency=None, maxnum=0):
+        self.phenox = phenox
+        self.camera = camera
+        self.frame_latency = frame_latency
+        self.maxnum = maxnum
+        self.history = StateHistory(history)
+        self._state = SelfState()
+        self._lock = threading.Lock()
+        self._image_requested = None
+        self._requests_used = False
+        self._features_requested = None
+
+    def sample_state(self):
+        """get current SelfState and record it with timestamp
+
+        call this in the control tick as often as possible.
+        """
+        self.phenox.get_selfstate(self._state)
+        t = monotonic_clock()
+        with self._lock:
+            self.history.push(self._state, t)
+
+    def request_image(self):
+        """call 'set_img_seq' and remember the time of the first request
+
+        use this instead of 'set_img_seq' (e.g. in the thread of
+        'get_image.py' sample).
+        """
+        t = monotonic_clock()
+        self.phenox.set_img_seq(self.camera)
+        with self._lock:
+            self._requests_used = True
+            if self._image_requested is None:
+                self._image_requested = t
+
+    def request_features(self):
+        """call 'set_imgfeature_query' and remember the time if accepted"""
+        t = monotonic_clock()
+        if self.phenox.set_imgfeature_query(self.camera):
+            with self._lock:
+                self._features_requested = t
+            return True
+        return False
+
+    def capture(self, restype="ndarray", image=None):
+        """return SensorBundle of the latest frame
+
+        None is returned if no frame is available or no state is sampled,
+        or if the capture time is unknown (no 'request_image' since the
+        previous frame and no frame_latency).
+
+        image: preallocated ndarray passed to 'get_image' (optional)
+        """
+        with self._lock:
+            requests_used = self._requests_used
+        if not requests_used and self.frame_latency is None:
+            raise ValueError(
+                "call 'request_image' or give measured 'frame_latency'")
+
+        if image is not None:
+            frame = image if self.phenox.get_image(
+                self.camera, restype, image) else None
+        else:
+            frame = self.phenox.get_image(self.camera, restype)
+        if frame is None:
+            return None
+        with self._lock:
+            #the next request starts the sequence of the next frame
+            requested = self._image_requested
+            self._image_requested = None
+        if requested is not None:
+            t = requested
+        elif self.frame_latency is not None:
+            t = monotonic_clock() - self.frame_latency
+        else:
+            return None
+
+        features = features_t = None
+        if self.maxnum > 0:
+            with self._lock:
+                pending = self._features_requested
+            if pending is not None:
+                features = self.phenox.get_imgfeature(self.maxnum)
+                if features is not None:
+                    features_t = pending
+                    pending = None
+                    with self._lock:
+                        self._features_requested = None
+            #otherwise still busy: keep waiting for the same query
+            if pending is None:
+                self.request_features()
+
+        return self.bundle(t, frame, features, features_t)
+
+    def bundle(self, t, frame, features=None, features_t=None):
+        """return SensorBundle for a frame captured at t
+
+        features_t: time the feature query was issued
+        """
+        with self._lock:
+            if len(self.history) == 0:
+                return None
+            oldest, newest = self.history.time_range()
+            state = self.history.state_at(t)
+            features_state = None
+            if features_t is not None:
+                features_state = self.history.state_at(features_t)
+        extrapolated = not (oldest <= t <= newest) or (
+            features_t is not None and not (oldest <= features_t <= newest))
+        return SensorBundle(t, frame, state, features, features_t,
+                            features_state, extrapolated)
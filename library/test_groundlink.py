@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""loopback tests of groundlink with a simulated vehicle.
+
+python -m unittest test_groundlink
+"""
+
+import time
+import unittest
+
+from groundlink import (
+    GroundLinkServer, GroundLinkClient, CMD_OPERATE_MODE, CMD_RANGECONTROL_Z,
+    pack_telemetry, unpack_telemetry
+)
+from phenox_client import Phenox, PX_UP
+from phenox_sim import SimBackend
+
+
+class GroundLinkLoopbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SimBackend(keepalive_timeout=None)
+        self.server = GroundLinkServer(
+            Phenox(self.backend), ("127.0.0.1", 0), rate=1000.0, batch=1)
+        self.server.start()
+        self.client = GroundLinkClient(self.server.address, ("127.0.0.1", 0))
+
+    def tearDown(self):
+        self.server.stop()
+        self.client.close()
+
+    def wait_received(self, count, timeout=2.0):
+        deadline = time.time() + timeout
+        while self.server.commands_received < count:
+            if time.time() > deadline:
+                self.fail("commands were not received")
+            time.sleep(0.001)
+
+    def test_setpoint_reaches_backend(self):
+        self.client.set_visioncontrol_xy(12.0, -34.0)
+        self.client.set_rangecontrol_z(150.0)
+        self.client.set_operate_mode(PX_UP)
+        self.wait_received(3)
+        self.assertEqual(self.server.apply_commands(), 3)
+        self.assertEqual((self.backend.dst_tx, self.backend.dst_ty),
+                         (12.0, -34.0))
+        self.assertEqual(self.backend.dst_tz, 150.0)
+        self.assertEqual(self.backend.mode, PX_UP)
+
+    def test_telemetry_round_trip(self):
+        self.backend.tx = 5.0
+        self.backend.height = 80.0
+        self.client.subscribe()
+        self.wait_received(1)
+        self.assertTrue(self.server.record())
+        samples = self.client.receive(timeout=2.0)
+        self.assertEqual(len(samples), 1)
+        self.assertAlmostEqual(samples[0].vision_tx, 5.0)
+        self.assertAlmostEqual(samples[0].height, 80.0)
+        self.assertEqual(samples[0].mode, self.backend.mode)
+
+        packet = pack_telemetry(7, [b"x" * 3])
+        self.assertIsNone(unpack_telemetry(packet))
+
+    def test_invalid_commands_rejected(self):
+        self.client.send_command(CMD_OPERATE_MODE, float("inf"))
+        self.client.send_command(CMD_RANGECONTROL_Z, float("nan"))
+        self.client.send_command(200, 1.0)
+        self.client.set_rangecontrol_z(90.0)
+        self.wait_received(4)
+        self.assertEqual(self.server.apply_commands(), 1)
+        self.assertEqual(self.server.commands_rejected, 3)
+        self.assertEqual(self.backend.dst_tz, 90.0)
+
+    def test_refuse_other_hosts(self):
+        self.server.allowed = frozenset(["127.0.0.2"])
+        self.client.set_rangecontrol_z(90.0)
+        deadline = time.time() + 2.0
+        while self.server.packets_refused < 1 and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.server.packets_refused, 1)
+        self.assertEqual(self.server.apply_commands(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
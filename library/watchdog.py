@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""keepalive and failsafe watchdog.
+
+'set_keepalive' has to be called periodically while user code is running.
+Watchdog calls it from a dedicated thread, but only while the user loop
+reports its heartbeat in time, so that a stalled user loop is still
+detected by Phenox.
+
+when the heartbeat misses its deadline or battery voltage gets low,
+Watchdog escalates through the configured actions
+(by default PX_DOWN, then PX_HALT 3 seconds later).
+
+usage:
+
+wd = Watchdog(px.default_phenox, heartbeat_timeout=0.2)
+wd.start()
+try:
+    while True:
+        wd.heartbeat()
+        #user code
+finally:
+    wd.stop()
+
+reaction time after a deadline miss is bounded by
+heartbeat_timeout + check_interval (+ the delay of each action).
+"""
+
+import os
+import threading
+
+from phenox_client import PX_HALT, PX_DOWN, monotonic_clock
+
+#(delay after failure [s], operate mode)
+DEFAULT_ESCALATION = ((0.0, PX_DOWN), (3.0, PX_HALT))
+
+#SCHED_FIFO priority of the watchdog thread
+DEFAULT_PRIORITY = 50
+
+
+class Watchdog(object):
+    """watch user loop heartbeat and Phenox battery in a dedicated thread
+
+    phenox: phenox_client.Phenox instance (or 'phenox' module)
+    heartbeat_timeout: heartbeat age regarded as deadline miss [s]
+    check_interval: period of the watchdog thread [s]
+    escalation: sequence of (delay [s], operate mode) applied in order
+        after failure is detected
+    check_battery: treat 'get_battery_is_low' as failure;
+        keepalive is still published while the heartbeat is fresh,
+        so the controlled landing is not overridden
+    priority: SCHED_FIFO priority of the watchdog thread
+        (None keeps normal scheduling; needs root privilege).
+        no effect on python 2, which has no 'os.sched_setscheduler'.
+        the outcome is reported as "priority_applied" of 'get_stats'.
+    on_failure: function(reason) called once after the first escalation
+        action; exceptions raised by it are ignored
+    """
+
+    def __init__(self, phenox, heartbeat_timeout=0.2, check_interval=0.01,
+                 escalation=DEFAULT_ESCALATION, check_battery=True,
+                 priority=DEFAULT_PRIORITY, on_failure=None):
+        self.phenox = phenox
+        self.heartbeat_timeout = heartbeat_timeout
+        self.check_interval = check_interval
+        self.escalation = tuple(escalation)
+        self.check_battery = check_battery
+        self.priority = priority
+        self.on_failure = on_failure
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        #None until the thread starts (or if priority is None)
+        self.priority_applied = None
+        self.priority_error = None
+        self.reset()
+
+    def reset(self):
+        """clear failure state and statistics"""
+        with self._lock:
+            self._last_heartbeat = monotonic_clock()
+            self.failure = None
+            self._failed_at = None
+            self._level = 0
+            self._notified = False
+            self.errors = 0
+            self.last_error = None
+            self.heartbeats = 0
+            self.max_heartbeat_interval = 0.0
+            self._sum_heartbeat_interval = 0.0
+            self.max_heartbeat_age = 0.0
+            self.deadline_misses = 0
+            self.reaction_time = None
+
+    def heartbeat(self):
+        """report that user loop is running; call it every loop"""
+        now = monotonic_clock()
+        with self._lock:
+            interval = now - self._last_heartbeat
+            self._last_heartbeat = now
+            self.heartbeats += 1
+            self._sum_heartbeat_interval += interval
+            if interval > self.max_heartbeat_interval:
+                self.max_heartbeat_interval = interval
+
+    def start(self):
+        """start watchdog thread"""
+        if self._thread is not None:
+            raise RuntimeError("watchdog is already running")
+        self._stop_event.clear()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """stop watchdog thread (keepalive is no more published)"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def is_failed(self):
+        """return True if failure has been detected"""
+        return self.failure is not None
+
+    def get_stats(self):
+        """return dict of heartbeat latency and failure statistics"""
+        with self._lock:
+            mean = (self._sum_heartbeat_interval / self.heartbeats
+                    if self.heartbeats else 0.0)
+            return {
+                "heartbeats": self.heartbeats,
+                "mean_heartbeat_interval": mean,
+                "max_heartbeat_interval": self.max_heartbeat_interval,
+                "max_heartbeat_age": self.max_heartbeat_age,
+                "deadline_misses": self.deadline_misses,
+                "failure": self.failure,
+                "escalation_level": self._level,
+                "reaction_time": self.reaction_time,
+                "errors": self.errors,
+                "priority_applied": self.priority_applied,
+                "priority_error": self.priority_error
+            }
+
+    def check(self):
+        """run one watchdog cycle (called periodically by the thread)"""
+        now = monotonic_clock()
+        with self._lock:
+            age = now - self._last_heartbeat
+            if age > self.max_heartbeat_age:
+                self.max_heartbeat_age = age
+            stale = age > self.heartbeat_timeout
+            if stale and self.failure is None:
+                self.deadline_misses += 1
+
+        if self.failure is None:
+            if stale:
+                #time elapsed since the deadline
+                self._fail("heartbeat", now, age - self.heartbeat_timeout)
+            elif self.check_battery and self.phenox.get_battery_is_low():
+                self._fail("battery", now, 0.0)
+        if not stale and self.failure != "heartbeat":
+            #user loop is alive (also while landing on low battery)
+            self.phenox.set_keepalive()
+        if self.failure is None:
+            return
+        self._escalate(now)
+        if not self._notified:
+            self._notified = True
+            if self.on_failure is not None:
+                try:
+                    self.on_failure(self.failure)
+                except Exception as error:
+                    self._record_error(error)
+
+    def _fail(self, reason, now, reaction_time):
+        with self._lock:
+            self.failure = reason
+            self._failed_at = now
+            self.reaction_time = reaction_time
+
+    def _record_error(self, error):
+        with self._lock:
+            self.errors += 1
+            self.last_error = error
+
+    def _escalate(self, now):
+        elapsed = now - self._failed_at
+        while self._level < len(self.escalation):
+            delay, mode = self.escalation[self._level]
+            if elapsed < delay:
+                break
+            if (mode == PX_HALT or
+                self.phenox.get_operate_mode() != PX_HALT):
+                self.phenox.set_operate_mode(mode)
+            self._level += 1
+
+    def _set_priority(self):
+        if self.priority is None:
+            return
+        setscheduler = getattr(os, "sched_setscheduler", None)
+        if setscheduler is None:
+            self.priority_applied = False
+            self.priority_error = "os.sched_setscheduler is not available"
+            return
+        try:
+            #pid 0 means the calling thread on Linux
+            setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except OSError as error:
+            self.priority_applied = False
+            self.priority_error = str(error)
+        else:
+            self.priority_applied = True
+            self.priority_error = None
+
+    def _run(self):
+        self._set_priority()
+        while not self._stop_event.is_set():
+            #the failsafe must survive any error; retried next cycle
+            try:
+                self.check()
+            except Exception as error:
+                self._record_error(error)
+            self._stop_event.wait(self.check_interval)